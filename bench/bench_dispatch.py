@@ -0,0 +1,74 @@
+"""Per-message command routing cost: the old startswith filter chain vs CommandTable.
+
+Run from the repository root:
+
+    python bench/bench_dispatch.py
+"""
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from magic_filter import F  # noqa: E402
+
+from commands import CommandTable  # noqa: E402
+
+# Filters in the order main.py used to register them
+OLD_CHAIN = [
+    F.text == '/start',
+    F.text == '/add_deadline',
+    F.text == '/all',
+    F.text.startswith('/create_queue'),
+    F.text.startswith('/join_queue'),
+    F.text.startswith('/leave_queue'),
+    F.text.startswith('/show_queue'),
+    F.text.startswith('/delete_queue'),
+    F.text.startswith('/set_priority'),
+    F.text.startswith('/shuffle_queue'),
+    F.text.startswith('/call_next'),
+    F.text.startswith('/move_to_front'),
+    F.text.startswith('/swap'),
+    F.text.startswith('/skip'),
+    F.text == '/admin_info',
+    F.text.startswith('/join'),
+    F.text.startswith('/leave'),
+    F.text.startswith('/show'),
+    F.text == '/queues',
+    F.text == '/deadlines',
+    F.text == '/notify',
+    F.text == '/pass',
+]
+
+NAMES = ['start', 'add_deadline', 'all', 'create_queue', 'join_queue', 'leave_queue', 'show_queue',
+         'delete_queue', 'set_priority', 'shuffle_queue', 'call_next', 'move_to_front', 'swap', 'skip',
+         'admin_info', 'join', 'leave', 'show', 'queues', 'deadlines', 'notify', 'pass']
+
+SAMPLES = ['/start', '/join Math', '/show Math', '/deadlines', '/pass', '/queues', 'hello there', '/unknown']
+
+
+def old_route(message):
+    for index, check in enumerate(OLD_CHAIN):
+        if check.resolve(message):
+            return index
+    return None
+
+
+def main():
+    table = CommandTable()
+    for name in NAMES:
+        table.command(name)(lambda message: None)
+    messages = [SimpleNamespace(text=text) for text in SAMPLES]
+    number = 20000
+
+    old = timeit.timeit(lambda: [old_route(m) for m in messages], number=number)
+    new = timeit.timeit(lambda: [table.match(m.text) for m in messages], number=number)
+    per_message = number * len(messages)
+    print(f"filter chain:  {old / per_message * 1e6:7.2f} us/message")
+    print(f"command table: {new / per_message * 1e6:7.2f} us/message")
+    print(f"speedup:       {old / new:7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""Synthetic load through the real Dispatcher, fully offline.
+
+Generated updates (commands, callback taps, form flows) are fed to
+dp.feed_update with the Bot API replaced by a recording fake session and
+gspread by an in-memory worksheet with configurable latency. Reports
+updates/sec, p50/p95/p99 per handler, the daily reminder run for N users x
+M deadlines, and peak RSS.
+
+Run from the repository root:
+
+    python bench/bench_load.py --users 2000 --deadlines 300 --updates 5000
+    python bench/bench_load.py --json before.json
+    python bench/bench_load.py --compare HEAD~1 HEAD
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def load_bot(src, args, workdir):
+    """Import main.py from src against the fakes; returns (main, storage, session, worksheet)"""
+    sys.path.insert(0, src)
+    sys.path.insert(0, HERE)
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+    os.environ.setdefault("ADMIN_USERNAMES", "admin")
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["PROFILE_SAMPLE_RATE"] = "0"
+    os.environ["METRICS_PORT"] = "0"
+    if args.broadcast_rate:
+        os.environ["BROADCAST_RATE"] = str(args.broadcast_rate)
+    from fakes import FakeSession, install_fake_sheets, make_rows
+
+    worksheet = install_fake_sheets(make_rows(args.deadlines), args.sheets_latency / 1000)
+    import main
+    import storage
+    storage.init_db(os.environ["DATABASE_PATH"])
+    for name in ("queue_engine", "fsm_storage", "sheet_mirror"):
+        component = getattr(main, name, None)
+        if component is not None and hasattr(component, "db"):
+            component.db = storage.db
+    session = FakeSession(args.api_latency / 1000)
+    main.bot.session = session
+    return main, storage, session, worksheet
+
+
+class Timings:
+    """Inner middleware collecting handler latencies by handler name"""
+
+    def __init__(self):
+        self.samples = {}
+
+    async def __call__(self, handler, event, data):
+        command = data.get("command_handler")
+        if command is not None:
+            name = command[0].__name__
+        else:
+            handler_object = data.get("handler")
+            name = handler_object.callback.__name__ if handler_object else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.samples.setdefault(name, []).append(time.perf_counter() - started)
+
+
+def workload(factory, users, count, seed=1):
+    """A repeatable mix of the traffic a semester start brings"""
+    rng = random.Random(seed)
+    scenarios = [
+        (30, lambda uid: [factory.message(uid, "/deadlines")]),
+        (10, lambda uid: [factory.callback(uid, "page_deadlines:1")]),
+        (10, lambda uid: [factory.message(uid, "/start")]),
+        (10, lambda uid: [factory.callback(uid, "deadlines")]),
+        (8, lambda uid: [factory.message(uid, "/queues")]),
+        (8, lambda uid: [factory.message(uid, "/join Math"), factory.message(uid, "/show Math")]),
+        (5, lambda uid: [factory.callback(uid, "show_Math")]),
+        (5, lambda uid: [factory.message(uid, "/leave Math")]),
+        (5, lambda uid: [factory.message(uid, "/pass")]),
+        (5, lambda uid: [factory.message(uid, "/notify"), factory.message(uid, "Yes")]),
+        (2, lambda uid: [factory.message(uid, "/add_deadline", "admin"),
+                         factory.message(uid, "31.12.2030 Bench task https://example.com", "admin")]),
+        (2, lambda uid: [factory.message(uid, "hello there")]),
+    ]
+    weights = [weight for weight, _ in scenarios]
+    updates = []
+    while len(updates) < count:
+        _, build = rng.choices(scenarios, weights)[0]
+        # Steps of one flow stay in order; flows of different users interleave
+        updates.append(build(rng.randrange(1, users + 1)))
+    return updates
+
+
+async def daily_run(main):
+    """The reminder work for one day, through whichever entry point the tree has"""
+    if hasattr(main, "check_deadlines"):
+        await main.check_deadlines()
+        return
+    # Per-deadline jobs: fire every job due today, as the scheduler would
+    from reminders import reminders
+    await main.get_all_records_async(fresh=True)
+    index = main.get_deadline_index()
+    today = date.today().toordinal()
+    reminders.batch_delay = 0
+    for offset in reminders.offsets:
+        for entry in index.due_on(today + offset):
+            await reminders.enqueue(list(entry.key), entry.name, entry.ordinal, offset)
+    if reminders._flush_task is not None:
+        await reminders._flush_task
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        main, storage, session, worksheet = load_bot(args.src, args, workdir)
+        from fakes import UpdateFactory
+
+        timings = Timings()
+        main.dp.message.middleware(timings)
+        main.dp.callback_query.middleware(timings)
+
+        # Subscribers and a queue to work with
+        await storage.db.write(lambda con: con.executemany(
+            "INSERT INTO users (chat_id, username, role) VALUES (?, ?, 'user')",
+            [(uid, f"user{uid}") for uid in range(1, args.users + 1)]))
+        await main.queue_engine.create("Math")
+
+        flows = workload(UpdateFactory(), args.users, args.updates)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def feed(flow):
+            async with semaphore:
+                for update in flow:
+                    await main.dp.feed_update(main.bot, update)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(feed(flow) for flow in flows))
+        elapsed = time.perf_counter() - started
+        handled = sum(len(flow) for flow in flows)
+
+        api_calls = len(session.calls)
+        started = time.perf_counter()
+        await daily_run(main)
+        daily = time.perf_counter() - started
+
+        storage.db.close()
+        return {
+            "updates": handled,
+            "seconds": elapsed,
+            "updates_per_sec": handled / elapsed,
+            "handlers": {
+                name: {"count": len(values), "p50_ms": percentile(values, 0.5) * 1000,
+                       "p95_ms": percentile(values, 0.95) * 1000, "p99_ms": percentile(values, 0.99) * 1000}
+                for name, values in sorted(timings.samples.items())
+            },
+            "daily_run_seconds": daily,
+            "daily_run_messages": len(session.calls) - api_calls,
+            "sheet_calls": worksheet.calls,
+            "users": args.users,
+            "deadlines": args.deadlines,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def report(result):
+    print(f"updates:       {result['updates']} in {result['seconds']:.2f}s "
+          f"({result['updates_per_sec']:.0f} updates/sec)")
+    print(f"daily run:     {result['daily_run_seconds']:.2f}s for {result['users']} users x "
+          f"{result['deadlines']} deadlines ({result['daily_run_messages']} API calls)")
+    print(f"sheet calls:   {result['sheet_calls']}")
+    print(f"peak RSS:      {result['peak_rss_mb']:.0f} MB")
+    print()
+    print(f"{'handler':32} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, row in result["handlers"].items():
+        print(f"{name:32} {row['count']:6} {row['p50_ms']:8.2f} {row['p95_ms']:8.2f} {row['p99_ms']:8.2f}")
+
+
+def compare(revisions, argv):
+    """Run the suite against two commits in temporary worktrees and print the change"""
+    results = []
+    for revision in revisions:
+        tree = tempfile.mkdtemp(prefix="bench-tree-")
+        out = os.path.join(tree, "result.json")
+        subprocess.run(["git", "worktree", "add", "--detach", tree, revision], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL)
+        try:
+            # This script drives both trees, so their numbers are comparable
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--src", os.path.join(tree, "src"),
+                            "--json", out, *argv], check=True, stdout=subprocess.DEVNULL)
+            with open(out) as f:
+                results.append(json.load(f))
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", tree], cwd=ROOT, check=False)
+    before, after = results
+
+    def line(label, old, new, unit):
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{label:32} {old:10.2f} {new:10.2f} {unit:6} {change:+7.1f}%")
+
+    print(f"{'':32} {revisions[0][:10]:>10} {revisions[1][:10]:>10}")
+    line("updates/sec", before["updates_per_sec"], after["updates_per_sec"], "")
+    line("daily run", before["daily_run_seconds"], after["daily_run_seconds"], "s")
+    line("sheet calls", before["sheet_calls"], after["sheet_calls"], "")
+    line("peak RSS", before["peak_rss_mb"], after["peak_rss_mb"], "MB")
+    for name in sorted(set(before["handlers"]) & set(after["handlers"])):
+        line(f"{name} p95", before["handlers"][name]["p95_ms"], after["handlers"][name]["p95_ms"], "ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--deadlines", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=3000, help="flows to generate (some span two updates)")
+    parser.add_argument("--concurrency", type=int, default=50, help="flows handled at once")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="ms per Bot API call")
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="ms per Sheets call")
+    parser.add_argument("--broadcast-rate", type=float,
+                        help="messages/sec for reminder sends (default: the bot's Telegram-safe limit)")
+    parser.add_argument("--src", default=os.path.join(ROOT, "src"))
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="two git revisions")
+    args = parser.parse_args()
+
+    if args.compare:
+        passthrough = [arg for arg in sys.argv[1:] if arg not in args.compare and arg != "--compare"]
+        compare(args.compare, passthrough)
+        return
+
+    result = asyncio.run(run(args))
+    report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
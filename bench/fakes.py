@@ -0,0 +1,153 @@
+"""Offline stand-ins for the Bot API and Google Sheets used by the benchmarks.
+
+install_fake_sheets() must run before sheets.py is imported; FakeSession is
+assigned to bot.session after main.py is imported.
+"""
+import asyncio
+import itertools
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import gspread
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+HEADER = ["Deadline", "Name", "Link", "Pass"]
+
+
+class FakeSession(BaseSession):
+    """Answers every Bot API call locally after `latency` seconds and records it"""
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = []
+        self._message_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append(type(method).__name__)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if getattr(method.__returning__, '__name__', '') == 'Message':
+            chat_id = getattr(method, 'chat_id', None) or 1
+            return Message(message_id=next(self._message_ids), date=datetime.now(),
+                           chat=Chat(id=chat_id, type='private'), text=getattr(method, 'text', None))
+        return True
+
+
+class FakeWorksheet:
+    """In-memory worksheet; every call blocks for `latency` seconds like a real HTTP round trip"""
+
+    id = 0
+
+    def __init__(self, rows, latency=0.0):
+        self.rows = [list(row) for row in rows]
+        self.latency = latency
+        self.calls = 0
+
+    def _wait(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_all_records(self):
+        self._wait()
+        return [dict(zip(HEADER, row)) for row in self.rows]
+
+    def get_all_values(self):
+        self._wait()
+        return [list(HEADER)] + [list(row) for row in self.rows]
+
+    def batch_get(self, ranges, major_dimension=None):
+        """'1:1' and whole-column 'X:X' ranges, column-major like major_dimension='COLUMNS'"""
+        self._wait()
+        table = [list(HEADER)] + self.rows
+        result = []
+        for span in ranges:
+            if span == "1:1":
+                result.append([[name] for name in HEADER])
+            else:
+                column = ord(span.split(':')[0]) - ord('A')
+                result.append([[row[column] if column < len(row) else '' for row in table]])
+        return result
+
+    def append_row(self, row):
+        self._wait()
+        self.rows.append(list(row) + [''] * (len(HEADER) - len(row)))
+
+    def append_rows(self, rows):
+        self._wait()
+        self.rows.extend(list(row) + [''] * (len(HEADER) - len(row)) for row in rows)
+
+    def delete_rows(self, index):
+        self._wait()
+        del self.rows[index - 2]
+
+
+class FakeSpreadsheet:
+    id = "fake-spreadsheet"
+
+    def __init__(self, worksheet):
+        self.sheet1 = worksheet
+
+    def batch_update(self, body):
+        self.sheet1._wait()
+        for request in body["requests"]:
+            span = request["deleteDimension"]["range"]
+            del self.sheet1.rows[span["startIndex"] - 1:span["endIndex"] - 1]
+
+
+class FakeClient:
+    def __init__(self, worksheet):
+        self.spreadsheet = FakeSpreadsheet(worksheet)
+
+    def open(self, *args, **kwargs):
+        return self.spreadsheet
+
+    open_by_key = open
+
+
+def make_rows(count, today=None):
+    """count deadlines spread over the next 30 days, a few due on reminder days"""
+    today = today or date.today()
+    offsets = [7, 1, 0, -1] + list(range(2, 30))
+    return [[(today + timedelta(days=offsets[i % len(offsets)])).strftime("%d.%m.%Y"),
+             f"Subject{i % 40} task {i}", f"https://example.com/{i}", f"Pass {i}"]
+            for i in range(count)]
+
+
+def install_fake_sheets(rows, latency=0.0):
+    """Route gspread.service_account to an in-memory sheet; returns the worksheet"""
+    worksheet = FakeWorksheet(rows, latency)
+    gspread.service_account = lambda *args, **kwargs: FakeClient(worksheet)
+    os.environ.setdefault("CREDENTIALS_FILE", "fake-credentials.json")
+    return worksheet
+
+
+class UpdateFactory:
+    """Builds Update objects for commands, callback taps and form replies"""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _user(self, uid, username):
+        return User(id=uid, is_bot=False, first_name=f"User{uid}", username=username or f"user{uid}")
+
+    def message(self, uid, text, username=None):
+        return Update(update_id=next(self._ids), message=Message(
+            message_id=next(self._ids), date=datetime.now(), chat=Chat(id=uid, type='private'),
+            from_user=self._user(uid, username), text=text))
+
+    def callback(self, uid, data, username=None):
+        update_id = next(self._ids)
+        return Update(update_id=update_id, callback_query=CallbackQuery(
+            id=str(update_id), from_user=self._user(uid, username), chat_instance=str(uid), data=data,
+            message=Message(message_id=next(self._ids), date=datetime.now(),
+                            chat=Chat(id=uid, type='private'), text='menu')))
@@ -0,0 +1,147 @@
+import asyncio
+import inspect
+import time
+from dataclasses import dataclass, field
+from os import getenv
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+
+from metrics import BROADCAST_SECONDS, RATE_LIMITED, SENDS
+
+# Telegram allows roughly 30 messages per second per bot overall and about one
+# message per second into the same chat.
+GLOBAL_RATE = float(getenv("BROADCAST_RATE", "28"))
+PER_CHAT_INTERVAL = float(getenv("BROADCAST_PER_CHAT_INTERVAL", "1.0"))
+CONCURRENCY = int(getenv("BROADCAST_CONCURRENCY", "20"))
+MAX_RETRIES = 3
+
+
+@dataclass
+class BroadcastReport:
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    elapsed: float = 0.0
+    blocked_chats: list = field(default_factory=list)
+
+    def summary(self):
+        return (f"<b>Delivery report</b>\n\n"
+                f"Sent: {self.sent}\nFailed: {self.failed}\nBlocked: {self.blocked}\n"
+                f"Time: {self.elapsed:.1f}s")
+
+
+class RateLimiter:
+    """Spaces acquisitions at least 1/rate seconds apart"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+
+    async def acquire(self):
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds):
+        """Hold back every sender, used when Telegram answers with RetryAfter"""
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+class Broadcaster:
+    def __init__(self, bot, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL,
+                 concurrency=CONCURRENCY, on_blocked=None):
+        self.bot = bot
+        self.limiter = RateLimiter(rate)
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.on_blocked = on_blocked
+        self._chat_next = {}
+
+    def _prune_chats(self):
+        """Forget chats whose next slot has passed; they could be sent to right away anyway"""
+        now = time.monotonic()
+        self._chat_next = {chat_id: slot for chat_id, slot in self._chat_next.items() if slot > now}
+
+    async def _wait_chat(self, chat_id):
+        now = time.monotonic()
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _send_one(self, chat_id, text, kwargs, report):
+        for attempt in range(MAX_RETRIES + 1):
+            await self._wait_chat(chat_id)
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                report.sent += 1
+                SENDS.inc("sent")
+                return
+            except TelegramRetryAfter as e:
+                RATE_LIMITED.inc()
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                report.blocked += 1
+                report.blocked_chats.append(chat_id)
+                SENDS.inc("blocked")
+                return
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    report.blocked += 1
+                    report.blocked_chats.append(chat_id)
+                    SENDS.inc("blocked")
+                else:
+                    print(f"Failed to send to chat_id {chat_id}: {e}")
+                    report.failed += 1
+                    SENDS.inc("failed")
+                return
+            except TelegramNetworkError as e:
+                if attempt == MAX_RETRIES:
+                    print(f"Failed to send to chat_id {chat_id}: {e}")
+                    break
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                print(f"Failed to send to chat_id {chat_id}: {e}")
+                break
+        report.failed += 1
+        SENDS.inc("failed")
+
+    async def send_many(self, messages, **kwargs):
+        """Deliver (chat_id, text) pairs and return a BroadcastReport"""
+        report = BroadcastReport()
+        started = time.monotonic()
+        queue = asyncio.Queue()
+        for chat_id, text in messages:
+            queue.put_nowait((chat_id, text))
+
+        async def worker():
+            while True:
+                try:
+                    chat_id, text = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self._send_one(chat_id, text, kwargs, report)
+
+        workers = min(self.concurrency, queue.qsize())
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        report.elapsed = time.monotonic() - started
+        BROADCAST_SECONDS.observe(report.elapsed)
+        self._prune_chats()
+
+        if report.blocked_chats and self.on_blocked:
+            result = self.on_blocked(report.blocked_chats)
+            if inspect.isawaitable(result):
+                await result
+        return report
+
+    async def broadcast(self, chat_ids, text, **kwargs):
+        """Send the same text to every chat"""
+        return await self.send_many(((chat_id, text) for chat_id in chat_ids), **kwargs)
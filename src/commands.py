@@ -0,0 +1,54 @@
+import inspect
+
+from aiogram.filters import Filter
+
+
+def parse_command(text):
+    """Split '/name@bot args' once into ('name', 'args'); None if text is not a command"""
+    if not text or text[0] != '/':
+        return None
+    token, _, args = text.partition(' ')
+    return token[1:].split('@', 1)[0], args.strip()
+
+
+class CommandTable(Filter):
+    """Routes commands by a single dict lookup instead of a chain of text filters.
+
+    Used as an aiogram filter, it matches only registered commands and passes
+    the handler and its pre-parsed arguments on as `command_handler` and
+    `command_args`, so unknown commands still reach FSM state handlers.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+
+    def command(self, *names):
+        """Register a handler for one or more command names (without the slash)"""
+        def decorator(func):
+            params = inspect.signature(func).parameters
+            entry = (func, 'state' in params, 'args' in params)
+            for name in names:
+                self.handlers[name] = entry
+            return func
+        return decorator
+
+    def match(self, text):
+        parsed = parse_command(text)
+        if parsed is None:
+            return None
+        entry = self.handlers.get(parsed[0])
+        if entry is None:
+            return None
+        return {"command_handler": entry, "command_args": parsed[1]}
+
+    async def __call__(self, message):
+        return self.match(message.text) or False
+
+    async def dispatch(self, message, state, command_handler, command_args):
+        func, wants_state, wants_args = command_handler
+        kwargs = {}
+        if wants_state:
+            kwargs['state'] = state
+        if wants_args:
+            kwargs['args'] = command_args
+        return await func(message, **kwargs)
@@ -0,0 +1,150 @@
+import codecs
+import csv
+from itertools import chain, islice
+from datetime import date, datetime
+from html import escape
+from os import getenv
+
+from deadline_index import DATE_FORMAT, parse_ordinal
+
+# Rows and bytes accepted in one /add_deadline import
+IMPORT_MAX_ROWS = int(getenv("IMPORT_MAX_ROWS", "500"))
+IMPORT_MAX_FILE_SIZE = int(getenv("IMPORT_MAX_FILE_SIZE", str(1024 * 1024)))
+# Header cell names for each of the [date, subject, link] fields
+HEADER_FIELDS = ({"deadline", "date"}, {"name", "subject"}, {"link"})
+HEADER_NAMES = set().union(*HEADER_FIELDS)
+# Lines of a CSV file looked at to guess its delimiter
+SNIFF_LINES = 20
+
+
+class ImportReport:
+    """Rows accepted for the sheet as (line, row) and rejected ones as (line, text, reason)"""
+
+    def __init__(self):
+        self.accepted = []
+        self.rejected = []
+
+    @property
+    def rows(self):
+        return [row for _, row in self.accepted]
+
+    def render(self, added=True):
+        status = "added" if added else "valid, not added"
+        lines = [f"<b>Import Report</b>\n\n{len(self.accepted)} {status}, {len(self.rejected)} rejected"]
+        if self.accepted:
+            lines.append(f"\n<b>{status.capitalize()}:</b>")
+            lines.extend(f"• {line}. <b>{row[0]}</b> {escape(row[1])}" for line, row in self.accepted)
+        if self.rejected:
+            lines.append("\n<b>Rejected:</b>")
+            lines.extend(f"• {line}. <code>{escape(text[:60])}</code> — {reason}" for line, text, reason in self.rejected)
+        return "\n".join(lines)
+
+
+def _cell(value):
+    if isinstance(value, (datetime, date)):
+        return value.strftime(DATE_FORMAT)
+    return "" if value is None else str(value).strip()
+
+
+def split_line(text):
+    """'DD.MM.YYYY Subject words Link' -> [date, subject, link]"""
+    parts = text.split()
+    if len(parts) < 3:
+        return parts
+    return [parts[0], " ".join(parts[1:-1]), parts[-1]]
+
+
+def check_row(cells, today, existing, seen):
+    """[date, subject, link] or the reason the row is rejected"""
+    if len(cells) < 3 or not all(cells[:3]):
+        return "expected a date, a subject and a link"
+    deadline, subject, link = cells[:3]
+    ordinal = parse_ordinal(deadline)
+    if ordinal is None:
+        return f"{deadline} is not a valid DD.MM.YYYY date"
+    if ordinal < today:
+        return "the date is in the past"
+    row = [date.fromordinal(ordinal).strftime(DATE_FORMAT), subject, link]
+    if tuple(row) in existing:
+        return "already in the sheet"
+    if tuple(row) in seen:
+        return "repeated in this import"
+    seen.add(tuple(row))
+    return row
+
+
+def iter_text(text):
+    """(line number, text, cells) per non-empty line of a message"""
+    for number, line in enumerate(text.splitlines(), 1):
+        if line.strip():
+            yield number, line.strip(), split_line(line)
+
+
+def iter_csv(stream):
+    """(line number, text, cells) per CSV record; ',' ';' and tab separated files are accepted"""
+    lines = codecs.iterdecode(stream, "utf-8-sig")
+    sample = list(islice(lines, SNIFF_LINES))
+    try:
+        dialect = csv.Sniffer().sniff("".join(sample), delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+
+    for number, cells in enumerate(csv.reader(chain(sample, lines), dialect), 1):
+        cells = [_cell(value) for value in cells]
+        if any(cells):
+            yield number, ", ".join(cells), cells
+
+
+def iter_xlsx(stream):
+    """(row number, text, cells) per row of the first worksheet, read without loading the whole file"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for number, values in enumerate(workbook.worksheets[0].iter_rows(values_only=True), 1):
+            cells = [_cell(value) for value in values]
+            if any(cells):
+                yield number, ", ".join(cells), cells
+    finally:
+        workbook.close()
+
+
+def _header_columns(cells):
+    """Positions of [date, subject, link] if cells is a header row, else None"""
+    names = [cell.lower() for cell in cells]
+    positions = [next((i for i, name in enumerate(names) if name in field), None) for field in HEADER_FIELDS]
+    if None not in positions:
+        return positions
+    if names and names[0] in HEADER_NAMES:
+        return [0, 1, 2]
+    return None
+
+
+def read_rows(items, existing_keys=(), max_rows=IMPORT_MAX_ROWS):
+    """Validate (number, text, cells) items into an ImportReport.
+
+    A leading header row is skipped, and columns are then taken by its
+    names; rows already in the sheet (by Deadline, Name and Link) or
+    repeated in the import are rejected.
+    """
+    report = ImportReport()
+    today = date.today().toordinal()
+    existing = set(existing_keys)
+    seen = set()
+    columns = None
+    for position, (number, text, cells) in enumerate(items):
+        if position == 0:
+            columns = _header_columns(cells)
+            if columns is not None:
+                continue
+        if len(report.accepted) + len(report.rejected) >= max_rows:
+            report.rejected.append((number, text, f"over the limit of {max_rows} rows"))
+            break
+        if columns is not None:
+            cells = [cells[i] if i < len(cells) else "" for i in columns]
+        result = check_row(cells, today, existing, seen)
+        if isinstance(result, str):
+            report.rejected.append((number, text, result))
+        else:
+            report.accepted.append((number, result))
+    return report
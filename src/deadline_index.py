@@ -0,0 +1,119 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+
+DATE_FORMAT = "%d.%m.%Y"
+
+
+def parse_ordinal(value):
+    """DD.MM.YYYY -> proleptic ordinal, None if the cell is not a valid date"""
+    try:
+        return datetime.strptime(str(value).strip(), DATE_FORMAT).toordinal()
+    except ValueError:
+        return None
+
+
+class DeadlineEntry:
+    __slots__ = ('ordinal', 'name', 'key', 'record')
+
+    def __init__(self, ordinal, name, key, record):
+        self.ordinal = ordinal
+        self.name = name
+        self.key = key
+        self.record = record
+
+    @property
+    def date(self):
+        return date.fromordinal(self.ordinal)
+
+
+class DeadlineIndex:
+    """Deadlines parsed once and kept sorted by date.
+
+    Dates are stored as ordinals in a parallel array, so "due on day X",
+    "due within N days" and "due before X" are bisect range lookups. add and
+    remove change the index in place, so a shared index is patched on a
+    copy() and then swapped in.
+    """
+
+    def __init__(self, records=(), key=None):
+        self._key = key or (lambda record: id(record))
+        self.ordinals = array('l')
+        self.entries = []
+        self.invalid = []
+        parsed = []
+        for record in records:
+            entry = self._entry(record)
+            if entry is None:
+                self.invalid.append(record)
+            else:
+                parsed.append(entry)
+        parsed.sort(key=lambda entry: entry.ordinal)
+        self.entries = parsed
+        self.ordinals = array('l', (entry.ordinal for entry in parsed))
+
+    def _entry(self, record):
+        ordinal = parse_ordinal(record.get("Deadline", ""))
+        if ordinal is None:
+            return None
+        return DeadlineEntry(ordinal, record.get("Name", "No description"), self._key(record), record)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def copy(self):
+        """An index sharing the entries but none of the lists, to patch without touching this one"""
+        clone = DeadlineIndex(key=self._key)
+        clone.ordinals = array('l', self.ordinals)
+        clone.entries = list(self.entries)
+        clone.invalid = list(self.invalid)
+        return clone
+
+    def records(self):
+        """Records in date order; rows with an unreadable date come last"""
+        return [entry.record for entry in self.entries] + list(self.invalid)
+
+    def between(self, first, last):
+        """Entries due from ordinal first to ordinal last, both inclusive"""
+        lo = bisect_left(self.ordinals, first)
+        hi = bisect_right(self.ordinals, last)
+        return self.entries[lo:hi]
+
+    def due_on(self, day):
+        ordinal = day.toordinal() if isinstance(day, date) else day
+        return self.between(ordinal, ordinal)
+
+    def due_within(self, days, today=None):
+        """Due from today up to and including today + days"""
+        start = (today or date.today()).toordinal()
+        return self.between(start, start + days)
+
+    def due_before(self, day):
+        ordinal = day.toordinal() if isinstance(day, date) else day
+        return self.entries[:bisect_left(self.ordinals, ordinal)]
+
+    def buckets(self, offsets, today=None):
+        """{days_until_due: entries} for each offset (negative = overdue)"""
+        start = (today or date.today()).toordinal()
+        return {offset: self.between(start + offset, start + offset) for offset in offsets}
+
+    def add(self, record):
+        entry = self._entry(record)
+        if entry is None:
+            self.invalid.append(record)
+            return None
+        position = bisect_right(self.ordinals, entry.ordinal)
+        self.ordinals.insert(position, entry.ordinal)
+        self.entries.insert(position, entry)
+        return entry
+
+    def remove(self, keys):
+        """Drop every entry whose key is in keys; returns how many were removed"""
+        keys = set(keys)
+        kept = [entry for entry in self.entries if entry.key not in keys]
+        removed = len(self.entries) - len(kept)
+        if removed:
+            self.entries = kept
+            self.ordinals = array('l', (entry.ordinal for entry in kept))
+        self.invalid = [record for record in self.invalid if self._key(record) not in keys]
+        return removed
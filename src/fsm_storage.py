@@ -0,0 +1,224 @@
+import asyncio
+import json
+import time
+from os import getenv
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+from storage import next_version
+
+# Abandoned forms are forgotten after FSM_STATE_TTL seconds without a change
+STATE_TTL = float(getenv("FSM_STATE_TTL", "86400"))
+# Changes within FSM_FLUSH_DELAY seconds are written together
+FLUSH_DELAY = float(getenv("FSM_FLUSH_DELAY", "0.05"))
+# States written by other instances are picked up every FSM_SYNC_INTERVAL
+# seconds; a cached state is re-read after FSM_CACHE_TTL seconds regardless
+SYNC_INTERVAL = float(getenv("FSM_SYNC_INTERVAL", "1"))
+CACHE_TTL = float(getenv("FSM_CACHE_TTL", "300"))
+
+_MISSING = object()
+
+
+def encode_key(key):
+    """StorageKey -> 'bot:chat:user[:thread[:business[:destiny]]]', trailing defaults dropped"""
+    parts = [key.bot_id, key.chat_id, key.user_id, key.thread_id or '', key.business_connection_id or '']
+    if key.destiny != 'default':
+        parts.append(key.destiny)
+    return ':'.join(map(str, parts)).rstrip(':')
+
+
+def encode_data(data):
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False) if data else None
+
+
+def _persist_states(con, upserts, deletes):
+    version = next_version(con, "fsm")
+    # A cleared state stays as an already expired row until the sweep, so the
+    # other instances see the change too
+    con.executemany("""
+        INSERT INTO fsm_states (key, state, data, expires_at, version) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET
+            state = excluded.state, data = excluded.data,
+            expires_at = excluded.expires_at, version = excluded.version
+    """, [(*upsert, version) for upsert in upserts] + [(key, None, None, 0.0, version) for key in deletes])
+
+def _read_state(con, key, now):
+    return con.execute(
+        "SELECT state, data, expires_at FROM fsm_states WHERE key = ? AND expires_at > ?", (key, now)
+    ).fetchone()
+
+def _read_changes(con, since):
+    return con.execute(
+        "SELECT key, state, data, expires_at, version FROM fsm_states WHERE version > ? ORDER BY version", (since,)
+    ).fetchall()
+
+def _read_version(con):
+    return con.execute("SELECT COALESCE(MAX(version), 0) FROM fsm_states").fetchone()[0]
+
+def _purge_expired(con, now):
+    return con.execute("DELETE FROM fsm_states WHERE expires_at <= ?", (now,)).rowcount
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage kept in the bot database.
+
+    Entries are cached in memory, so checking the state of an update costs
+    no disk read. Every write bumps the row's version, and a background
+    task fetches the rows changed since the last check every SYNC_INTERVAL
+    seconds, so updates handled by another instance are picked up without
+    re-reading each key. CACHE_TTL is only a safety net. Changes mark the
+    entry dirty and are flushed FLUSH_DELAY later in one write job, which
+    folds the usual set_state + set_data pair into a single upsert. States
+    untouched for STATE_TTL seconds are treated as empty and purged by
+    sweep().
+    """
+
+    def __init__(self, db=None, ttl=STATE_TTL, flush_delay=FLUSH_DELAY, cache_ttl=CACHE_TTL,
+                 sync_interval=SYNC_INTERVAL):
+        self.db = db
+        self.ttl = ttl
+        self.flush_delay = flush_delay
+        self.cache_ttl = cache_ttl
+        self.sync_interval = sync_interval
+        self.version = 0
+        self._cache = {}
+        self._dirty = set()
+        self._flush_handle = None
+        self._pending = []
+        self._task = None
+
+    async def _load(self, k, now):
+        row = None
+        if self.db is not None:
+            row = await self.db.read(_read_state, k, now)
+        if row is None:
+            return [None, {}, 0.0, now]
+        return [row[0], json.loads(row[1]) if row[1] else {}, row[2], now]
+
+    async def _entry(self, key):
+        """[state, data, expires_at, checked_at] for key, re-read once the cached copy is CACHE_TTL old"""
+        k = encode_key(key)
+        entry = self._cache.get(k, _MISSING)
+        now = time.time()
+        if entry is _MISSING:
+            loaded = await self._load(k, now)
+            # A write may have landed while the read was in flight
+            entry = self._cache.setdefault(k, loaded)
+        elif now - entry[3] >= self.cache_ttl and k not in self._dirty:
+            checked_at = entry[3]
+            loaded = await self._load(k, now)
+            # Keep local changes made while the read was in flight
+            if entry[3] == checked_at and k not in self._dirty:
+                entry[:] = loaded
+        if entry[2] and entry[2] <= now:
+            entry[0], entry[1], entry[2] = None, {}, 0.0
+        return k, entry
+
+    async def refresh(self):
+        """Apply states other instances wrote since the last check to cached entries"""
+        started = time.time()
+        rows = await self.db.read(_read_changes, self.version)
+        for k, state, data, expires_at, version in rows:
+            self.version = max(self.version, version)
+            entry = self._cache.get(k)
+            # Local changes, flushed or not, are at least as new as the row
+            if entry is None or k in self._dirty or entry[3] >= started:
+                continue
+            entry[:] = [state, json.loads(data) if data else {}, expires_at, started]
+        return len(rows)
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"FSM state sync failed: {e}")
+
+    async def start(self):
+        """Start polling for states changed on other instances"""
+        if self.db is not None and self._task is None:
+            self.version = await self.db.read(_read_version)
+            self._task = asyncio.create_task(self._sync_loop())
+
+    def _touch(self, k, entry):
+        entry[3] = time.time()
+        entry[2] = entry[3] + self.ttl
+        self._dirty.add(k)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_delay, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        if not self._dirty:
+            return
+        upserts, deletes = [], []
+        for k in self._dirty:
+            state, data, expires_at, _ = self._cache[k]
+            if state is None and not data:
+                deletes.append(k)
+                del self._cache[k]
+            else:
+                upserts.append((k, state, encode_data(data), expires_at))
+        self._dirty.clear()
+        if self.db is None:
+            return
+        future = self.db.submit(_persist_states, upserts, deletes)
+        future.add_done_callback(_log_failure)
+        self._pending = [f for f in self._pending if not f.done()] + [future]
+
+    async def set_state(self, key, state=None):
+        k, entry = await self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        self._touch(k, entry)
+
+    async def get_state(self, key):
+        _, entry = await self._entry(key)
+        return entry[0]
+
+    async def set_data(self, key, data):
+        k, entry = await self._entry(key)
+        entry[1] = dict(data)
+        self._touch(k, entry)
+
+    async def get_data(self, key):
+        _, entry = await self._entry(key)
+        return dict(entry[1])
+
+    def state_counts(self):
+        """{(state,): conversations} for states cached and not expired"""
+        now = time.time()
+        counts = {}
+        for state, _, expires_at, _ in list(self._cache.values()):
+            if state is not None and expires_at > now:
+                counts[(state,)] = counts.get((state,), 0) + 1
+        return counts
+
+    async def sweep(self):
+        """Drop expired and empty states from memory and expired ones from the database"""
+        now = time.time()
+        for k in [k for k, entry in self._cache.items() if entry[2] <= now and k not in self._dirty]:
+            del self._cache[k]
+        if self.db is None:
+            return 0
+        return await self.db.write(_purge_expired, now)
+
+    async def close(self):
+        """Stop polling, write out pending changes and wait for them"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush()
+        if self._pending:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in self._pending), return_exceptions=True)
+            self._pending = []
+
+
+def _log_failure(future):
+    error = future.exception()
+    if error is not None:
+        print(f"FSM state write failed: {error}")
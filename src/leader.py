@@ -0,0 +1,93 @@
+import asyncio
+import functools
+import os
+import socket
+import time
+import uuid
+from os import getenv
+
+# A leader that stops renewing is replaced after LEADER_LEASE seconds
+LEASE = float(getenv("LEADER_LEASE", "30"))
+HEARTBEAT = float(getenv("LEADER_HEARTBEAT", "10"))
+
+
+def _claim(con, name, holder, now, lease):
+    """Take or extend the lease if it is ours or has run out; returns the holder"""
+    con.execute("""
+        INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+        WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+    """, (name, holder, now + lease, now))
+    return con.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()[0]
+
+def _release(con, name, holder):
+    con.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+
+class LeaderLock:
+    """Lease in the shared database that elects one instance to run scheduled jobs.
+
+    Every instance heartbeats every HEARTBEAT seconds; the holder extends its
+    lease, the others take over once it has been expired for a beat. A clean
+    shutdown releases the lease so a standby takes over on its next beat.
+    on_change(is_leader) is called whenever this instance gains or loses it.
+    """
+
+    def __init__(self, db=None, name="scheduler", lease=LEASE, heartbeat=HEARTBEAT, on_change=None):
+        self.db = db
+        self.name = name
+        self.lease = lease
+        self.heartbeat = heartbeat
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.valid_until = 0.0
+        self.on_change = on_change
+        self._task = None
+
+    async def renew(self):
+        """Claim or extend the lease; returns whether this instance holds it"""
+        now = time.time()
+        try:
+            holder = await self.db.write(_claim, self.name, self.holder, now, self.lease)
+        except Exception as e:
+            print(f"Leader lease renewal failed: {e}")
+            holder = None
+        leader = holder == self.holder
+        changed = leader != self.is_leader
+        self.is_leader = leader
+        self.valid_until = now + self.lease if leader else 0.0
+        if changed:
+            print(f"{self.holder} {'acquired' if leader else 'lost'} the '{self.name}' lease")
+            if self.on_change:
+                self.on_change(leader)
+        return leader
+
+    async def _beat(self):
+        while True:
+            await self.renew()
+            await asyncio.sleep(self.heartbeat)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._beat())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            self.is_leader = False
+            if self.on_change:
+                self.on_change(False)
+            await self.db.write(_release, self.name, self.holder)
+
+    def guard(self, func):
+        """Wrap a job so it runs only on the instance holding the lease"""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            # Confirm right before running rather than trusting the last beat
+            if not await self.renew():
+                return None
+            return await func(*args, **kwargs)
+        return wrapper
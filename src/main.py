@@ -1,30 +1,125 @@
 import asyncio
+import json
 import logging
-import sqlite3
-import re
 import os
 import sys
+import time
+from datetime import date
 
 from aiogram import Bot, Dispatcher, Router, F, html
 from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ParseMode
-from aiogram.filters import CommandStart
 from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, BotCommand
-from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
-from utilities import get_keyboard, all_deadlines
-from sheets import get_all_records, add_row, delete_row
+from commands import CommandTable
+from utilities import get_keyboard, get_page, page_keyboard, build_digest, build_change_notice, split_message
+from broadcast import Broadcaster
+import storage
+from storage import init_db, reads, writes
+from queue_engine import QueueEngine
+from fsm_storage import SQLiteStorage
+from leader import LeaderLock
+from mirror import SheetMirror
+from deadline_index import DeadlineIndex
+from deadline_import import IMPORT_MAX_FILE_SIZE, iter_csv, iter_text, iter_xlsx, read_rows
+from reminders import JOBSTORE, REMINDER_TIME_TEXT, SECTION_NAMES, reminders, schedule_lines, schedule_sentence
+from preferences import (PREFS_POLL_INTERVAL, ReminderDispatcher, ReminderPrefs, parse_timezone, subject_token, render_prefs,
+                         menu_keyboard, timezone_keyboard, hour_keyboard, offsets_keyboard, mute_keyboard)
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from webhook import BOT_MODE, WebhookServer
+import metrics
+import profiling
+from sheets import connect_async, get_all_records_async, get_columns_async, peek_records, get_deadline_index, add_rows_async, row_record, delete_records_async, record_key, get_cache_stats, get_sheets_status, SheetsError
 from os import getenv
 
 load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
-dp = Dispatcher()
+fsm_storage = SQLiteStorage()
+dp = Dispatcher(storage=fsm_storage)
+dp.update.outer_middleware(profiling.UpdateProfiler())
+dp.message.middleware(profiling.HandlerTimer())
+dp.callback_query.middleware(profiling.HandlerTimer())
+dp.message.middleware(metrics.HandlerMetrics())
+dp.callback_query.middleware(metrics.HandlerMetrics())
+metrics.FSM_STATES.func = fsm_storage.state_counts
 router = Router()
+commands = CommandTable()
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot.session.middleware(profiling.ApiTimer())
+
+@reads
+def get_subscribers(con):
+    """Chat ids of users who enabled notifications and have not blocked the bot"""
+    cursor = con.execute("SELECT chat_id FROM users WHERE active = 1")
+    return [row[0] for row in cursor.fetchall() if row[0]]
+
+@reads
+def get_default_subscribers(con):
+    """Subscribers without their own reminder settings; they get the shared digest"""
+    cursor = con.execute("SELECT chat_id FROM users WHERE active = 1 AND reminder_prefs IS NULL")
+    return [row[0] for row in cursor.fetchall() if row[0]]
+
+@reads
+def load_reminder_prefs(con, chat_ids=None):
+    """(chat_id, prefs_json) for active users with their own settings, optionally only chat_ids"""
+    if chat_ids is None:
+        cursor = con.execute("SELECT chat_id, reminder_prefs FROM users WHERE active = 1 AND reminder_prefs IS NOT NULL")
+    else:
+        cursor = con.execute("""
+            SELECT chat_id, reminder_prefs FROM users
+            WHERE active = 1 AND reminder_prefs IS NOT NULL AND chat_id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(chat_ids),))
+    return cursor.fetchall()
+
+@reads
+def changed_reminder_prefs(con, since):
+    """(chat_id, prefs_json or None, prefs_version) for users changed after version since"""
+    cursor = con.execute("""
+        SELECT chat_id, CASE WHEN active = 1 THEN reminder_prefs END, prefs_version
+        FROM users WHERE prefs_version > ? ORDER BY prefs_version
+    """, (since,))
+    return cursor.fetchall()
+
+@reads
+def get_prefs_version(con):
+    return con.execute("SELECT COALESCE(MAX(prefs_version), 0) FROM users").fetchone()[0]
+
+# Writes are serialized, so this hands out increasing versions across instances
+BUMP_PREFS_VERSION = "prefs_version = (SELECT COALESCE(MAX(prefs_version), 0) + 1 FROM users)"
+
+@reads
+def get_reminder_prefs(con, chat_id):
+    row = con.execute("SELECT reminder_prefs FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+    return row[0] if row else None
+
+@writes
+def save_reminder_prefs(con, chat_id, username, prefs_json):
+    """Store settings (None = back to the default schedule); saving subscribes the chat"""
+    con.execute("INSERT OR IGNORE INTO users (chat_id, username, role) VALUES (?, ?, 'user')", 
+                (chat_id, username))
+    con.execute(f"UPDATE users SET reminder_prefs = ?, active = 1, {BUMP_PREFS_VERSION} WHERE chat_id = ?",
+                (prefs_json, chat_id))
+
+@writes
+def mark_inactive(con, chat_ids):
+    """Stop broadcasting to chats that blocked the bot"""
+    con.executemany(f"UPDATE users SET active = 0, {BUMP_PREFS_VERSION} WHERE chat_id = ?",
+                    [(chat_id,) for chat_id in chat_ids])
+
+@writes
+def subscribe(con, chat_id, username, role):
+    """Add or re-activate a notification subscriber"""
+    con.execute("INSERT OR IGNORE INTO users (chat_id, username, role) VALUES (?, ?, ?)", 
+                (chat_id, username, role))
+    con.execute(f"UPDATE users SET active = 1, {BUMP_PREFS_VERSION} WHERE chat_id = ?", (chat_id,))
+    if role == 'admin':
+        con.execute("UPDATE users SET role = 'admin' WHERE chat_id = ?", (chat_id,))
+
+broadcaster = Broadcaster(bot, on_blocked=mark_inactive)
 
 class DeadlineForm(StatesGroup):
     waiting_for_deadline = State()
@@ -32,6 +127,9 @@ class DeadlineForm(StatesGroup):
 class NotificationForm(StatesGroup):
     waiting_for_notification = State()
 
+class ReminderForm(StatesGroup):
+    waiting_for_timezone = State()
+
 class AllNotify(StatesGroup):
     all_notify = State()
 
@@ -40,161 +138,118 @@ class QueueForm(StatesGroup):
     waiting_for_priority_user = State()
     waiting_for_queue_action = State()
 
-async def check_deadlines():
-    records = get_all_records()
-    today = datetime.today().date()
-    cursor.execute("SELECT chat_id FROM users")
-    chat_ids = [row[0] for row in cursor.fetchall() if row[0]]
-    rows_to_delete = []
+async def sync_deadlines():
+    """Schedule reminder jobs for deadlines found in the sheet, drop jobs for removed ones"""
+    if await sheet_mirror.sync() is None:
+        print("Skipping deadline sync: the sheet could not be read")
+        return
+    added = await reminders.schedule_async(get_deadline_index().entries, prune=True)
+    print(f"Deadline sync: {added} reminder jobs added")
+
+async def schedule_deadlines():
+    """After each sheet sync on the lease holder: jobs for rows added anywhere, none for removed or edited ones"""
+    index = get_deadline_index()
+    if index is not None:
+        added = await reminders.schedule_async(index.entries, prune=True)
+        if added:
+            print(f"Scheduled {added} reminder jobs for new deadlines")
+
+# Rows deleted on expiry, kept for a few days so personal digests sent later
+# in the day (or in a later time zone) still list them as expired
+expired_rows = DeadlineIndex(key=record_key)
+EXPIRED_KEEP_DAYS = 3
+
+def remember_expired(keys):
+    """Copy the rows about to be deleted on expiry into expired_rows"""
+    global expired_rows
+    index = get_deadline_index()
+    if index is None:
+        return
+    keys = set(keys)
+    cutoff = date.today().toordinal() - EXPIRED_KEEP_DAYS
+    kept = [entry.record for entry in expired_rows.entries if entry.ordinal >= cutoff and entry.key not in keys]
+    expired_rows = DeadlineIndex(kept + [entry.record for entry in index.entries if entry.key in keys],
+                                 key=record_key)
+
+async def deliver_reminders(sections, expired_keys):
+    """Send the reminders that fell due together as one digest, then drop expired rows"""
+    chat_ids = await get_default_subscribers()
+    # One digest per chat instead of one message per deadline
+    chunks = split_message(build_digest(sections))
+    if chunks and chat_ids:
+        messages = [(chat_id, chunk) for chat_id in chat_ids for chunk in chunks]
+        report = await broadcaster.send_many(messages)
+        print(f"Deadline reminders: {report.sent} sent, {report.failed} failed, {report.blocked} blocked in {report.elapsed:.1f}s")
     
-    for i, record in enumerate(records, start=2):
-        try:
-            deadline_date = datetime.strptime(record["Deadline"], "%d.%m.%Y").date()
-            name = record.get("Name", "No description")
-            
-            if deadline_date - today == timedelta(days=7):
-                for chat_id in chat_ids:
-                    await bot.send_message(
-                        chat_id=chat_id,
-                        text=f"<b>Weekly Reminder</b>\n\n1 week left until <b>{deadline_date}</b>\n<b>{name}</b>\n\n<i>Time to start planning!</i>"
-                    )
-
-            if deadline_date - today == timedelta(days=1):
-                for chat_id in chat_ids:
-                    await bot.send_message(
-                        chat_id=chat_id,
-                        text=f"<b>Final Reminder</b>\n\nTomorrow is the deadline: <b>{deadline_date}</b>\n<b>{name}</b>\n\n<i>Last chance to finish!</i>"
-                    )
-
-            elif deadline_date == today:
-                for chat_id in chat_ids:
-                    await bot.send_message(
-                        chat_id=chat_id,
-                        text=f"<b>DEADLINE TODAY!</b>\n\n<b>{deadline_date}</b>\n<b>{name}</b>\n\n<i>Submit now!</i>"
-                    )
-            elif today - deadline_date == timedelta(days=1):
-                for chat_id in chat_ids:
-                    await bot.send_message(
-                        chat_id=chat_id,
-                        text=f"<b>Deadline Expired</b>\n\nYesterday was the deadline: <b>{deadline_date}</b>\n<b>{name}</b>\n\n<i>This task will be deleted now.</i>"
-                    )
-                rows_to_delete.append(i)
-        except Exception as e:
-            print("Error parsing record:", record, e)
-    
-    for row_number in reversed(rows_to_delete):
-        delete_row(row_number)
-
-
-# Queue Management Functions
-def create_queue(queue_name):
-    """Create a new queue"""
-    cursor.execute("INSERT OR IGNORE INTO queues (name) VALUES (?)", (queue_name,))
-    con.commit()
-    return cursor.lastrowid
-
-def join_queue(queue_name, chat_id, username):
-    """Join a queue"""
-    cursor.execute("SELECT id FROM queues WHERE name = ?", (queue_name,))
-    queue = cursor.fetchone()
-    if not queue:
-        return False, "Queue not found"
-    
-    queue_id = queue[0]
-    cursor.execute("SELECT id FROM queue_members WHERE queue_id = ? AND chat_id = ?", (queue_id, chat_id))
-    if cursor.fetchone():
-        return False, "You are already in this queue"
-    
-    cursor.execute("INSERT INTO queue_members (queue_id, chat_id, username, priority, joined_at) VALUES (?, ?, ?, 0, datetime('now'))", 
-                   (queue_id, chat_id, username))
-    con.commit()
-    return True, "Successfully joined the queue"
-
-def leave_queue(queue_name, chat_id):
-    """Leave a queue"""
-    cursor.execute("SELECT id FROM queues WHERE name = ?", (queue_name,))
-    queue = cursor.fetchone()
-    if not queue:
-        return False, "Queue not found"
-    
-    queue_id = queue[0]
-    cursor.execute("DELETE FROM queue_members WHERE queue_id = ? AND chat_id = ?", (queue_id, chat_id))
-    con.commit()
-    return True, "Successfully left the queue"
-
-def get_queue_members(queue_name):
-    """Get all members of a queue ordered by priority and join time"""
-    cursor.execute("""
-        SELECT qm.chat_id, qm.username, qm.priority, qm.joined_at 
-        FROM queue_members qm 
-        JOIN queues q ON qm.queue_id = q.id 
-        WHERE q.name = ? 
-        ORDER BY qm.priority DESC, qm.joined_at ASC
-    """, (queue_name,))
-    return cursor.fetchall()
-
-def get_all_queues():
-    """Get all available queues"""
-    cursor.execute("SELECT name FROM queues")
-    return [row[0] for row in cursor.fetchall()]
-
-def delete_queue(queue_name):
-    """Delete a queue and all its members"""
-    cursor.execute("SELECT id FROM queues WHERE name = ?", (queue_name,))
-    queue = cursor.fetchone()
-    if not queue:
-        return False, "Queue not found"
-    
-    queue_id = queue[0]
-    cursor.execute("DELETE FROM queue_members WHERE queue_id = ?", (queue_id,))
-    cursor.execute("DELETE FROM queues WHERE id = ?", (queue_id,))
-    con.commit()
-    return True, "Queue deleted successfully"
-
-def set_priority(queue_name, username, priority):
-    """Set priority for a user in a queue"""
-    cursor.execute("SELECT id FROM queues WHERE name = ?", (queue_name,))
-    queue = cursor.fetchone()
-    if not queue:
-        return False, "Queue not found"
-    
-    queue_id = queue[0]
-    cursor.execute("UPDATE queue_members SET priority = ? WHERE queue_id = ? AND username = ?", 
-                   (priority, queue_id, username))
-    if cursor.rowcount == 0:
-        return False, "User not found in queue"
-    
-    con.commit()
-    return True, f"Priority set to {priority} for {username}"
-
-def shuffle_queue(queue_name):
-    """Randomly shuffle queue members"""
-    cursor.execute("SELECT id FROM queues WHERE name = ?", (queue_name,))
-    queue = cursor.fetchone()
-    if not queue:
-        return False, "Queue not found"
-    
-    queue_id = queue[0]
-    cursor.execute("SELECT id FROM queue_members WHERE queue_id = ?", (queue_id,))
-    members = cursor.fetchall()
-    
-    if len(members) < 2:
-        return False, "Need at least 2 members to shuffle"
-    
-    # Get all member IDs and shuffle them
-    import random
-    member_ids = [member[0] for member in members]
-    random.shuffle(member_ids)
-    
-    # Update join times to reflect new order (most recent first for shuffled order)
-    current_time = datetime.now()
-    for i, member_id in enumerate(member_ids):
-        new_time = current_time - timedelta(seconds=i)
-        cursor.execute("UPDATE queue_members SET joined_at = ? WHERE id = ?", 
-                       (new_time.strftime('%Y-%m-%d %H:%M:%S'), member_id))
-    
-    con.commit()
-    return True, f"Queue '{queue_name}' has been shuffled randomly"
+    if expired_keys:
+        remember_expired(expired_keys)
+        result = await delete_records_async(expired_keys)
+        if isinstance(result, SheetsError):
+            print(f"Expired rows were not deleted: {result.message}")
+
+reminders.deliver = deliver_reminders
+
+async def announce_sheet_changes(added, edited):
+    """Announce deadlines an admin added or edited directly in the sheet"""
+    chat_ids = await get_subscribers()
+    chunks = split_message(build_change_notice(added, edited))
+    if chunks and chat_ids:
+        report = await broadcaster.send_many([(chat_id, chunk) for chat_id in chat_ids for chunk in chunks])
+        print(f"Sheet changes announced: {report.sent} sent, {report.failed} failed, {report.blocked} blocked")
+
+sheet_mirror = SheetMirror(on_change=announce_sheet_changes, after_sync=schedule_deadlines)
+
+async def deliver_personal_reminders(due):
+    """Digest for each user whose own reminder time has come, in their time zone"""
+    # Settings may have changed on another instance since these were queued
+    fresh = dict(await load_reminder_prefs([chat_id for chat_id, _, _ in due]))
+    records = await get_all_records_async()
+    if isinstance(records, SheetsError):
+        print(f"Skipping personal reminders: {records.message}")
+        return
+    index = get_deadline_index()
+    messages = []
+    for chat_id, prefs, fire_at in due:
+        current = fresh.get(chat_id)
+        if current is None:
+            reminder_dispatcher.set(chat_id, None)
+            continue
+        if current != prefs.to_json():
+            prefs = ReminderPrefs.from_json(current)
+            reminder_dispatcher.set(chat_id, prefs)
+        sections = {}
+        today = prefs.local_date(fire_at)
+        gone = expired_rows.buckets(prefs.offsets, today)
+        for offset, entries in index.buckets(prefs.offsets, today).items():
+            # A row already deleted on expiry is only in expired_rows; one whose delete failed is in both
+            keys = {entry.key for entry in entries}
+            entries = entries + [entry for entry in gone[offset] if entry.key not in keys]
+            items = [(entry.date, entry.name) for entry in entries if entry.name not in prefs.muted]
+            if items:
+                sections[SECTION_NAMES.get(offset, offset)] = items
+        messages.extend((chat_id, chunk) for chunk in split_message(build_digest(sections)))
+    if messages:
+        report = await broadcaster.send_many(messages)
+        print(f"Personal reminders: {report.sent} sent, {report.failed} failed, {report.blocked} blocked in {report.elapsed:.1f}s")
+
+reminder_dispatcher = ReminderDispatcher(deliver_personal_reminders)
+
+async def start_personal_reminders():
+    # Read the version first: changes landing during the load are applied again, harmlessly
+    version = await get_prefs_version()
+    reminder_dispatcher.load(await load_reminder_prefs())
+    reminder_dispatcher.version = version
+    reminder_dispatcher.start()
+
+async def refresh_reminder_prefs():
+    """On the lease holder: apply settings saved on any instance since the last check"""
+    changed = reminder_dispatcher.apply(await changed_reminder_prefs(reminder_dispatcher.version))
+    if changed:
+        print(f"Reminder settings reloaded for {changed} users")
+
+
+# Queue state lives in memory, written behind and reloaded when another instance changes it (see queue_engine.py)
+queue_engine = QueueEngine()
 
 async def setup_bot_commands():
     """Set up bot commands menu"""
@@ -203,11 +258,27 @@ async def setup_bot_commands():
         BotCommand(command="queues", description="📋 Show all queues"),
         BotCommand(command="deadlines", description="📅 View deadlines"),
         BotCommand(command="notify", description="🔔 Enable notifications"),
+        BotCommand(command="reminders", description="⏰ Reminder settings"),
         BotCommand(command="pass", description="📝 View works to pass"),
     ]
     await bot.set_my_commands(commands)
 
-@dp.message(CommandStart())
+async def warm_up():
+    """Open the spreadsheet and register the command menu while polling starts"""
+    async def timed(phase, step):
+        started = time.perf_counter()
+        try:
+            result = await step
+            if isinstance(result, SheetsError):
+                print(f"Startup {phase} failed: {result.message}")
+        except Exception as e:
+            print(f"Startup {phase} failed: {e}")
+        profiling.startup.add(phase, time.perf_counter() - started)
+
+    await asyncio.gather(timed("sheets", connect_async()), timed("commands", setup_bot_commands()))
+    profiling.startup.report()
+
+@commands.command('start')
 async def command_start_handler(message: Message) -> None:
     welcome_text = f"""
 <b>Welcome to Deadline Checker Bot</b>
@@ -215,7 +286,7 @@ async def command_start_handler(message: Message) -> None:
 Hello, {html.bold(html.quote(message.from_user.full_name))}!
 
 <b>Features:</b>
-• Send daily reminders at 12:00 PM
+• Send daily reminders at {REMINDER_TIME_TEXT}
 • Show all your deadlines
 • Enable notifications
 • View assignments to pass
@@ -235,9 +306,10 @@ Hello, {html.bold(html.quote(message.from_user.full_name))}!
 • <code>/queues</code> - Show all queues
 • <code>/deadlines</code> - View deadlines
 • <code>/notify</code> - Enable notifications
+• <code>/reminders</code> - Reminder time, time zone, days and muted subjects
 • <code>/pass</code> - View works to pass
 
-<i>I'll remind you 7 days before, 1 day before, on the deadline day, and delete expired tasks automatically.</i>
+<i>I'll remind you {schedule_sentence()}, and delete expired tasks automatically.</i>
 """
     await message.answer(welcome_text, reply_markup=get_keyboard([('Deadlines','deadlines'),('See my points','points'),('Notifications','notify'),('Pass','pass'),('Queues','queues')]))
 
@@ -247,30 +319,56 @@ async def points_handler(callback: CallbackQuery):
     await callback.message.answer("This feature is not available yet. Please wait for the next release.")
     await callback.answer()
 
+# Deadline list views: (fields, header, footer, empty text)
+DEADLINE_VIEWS = {
+    'deadlines': (['Deadline', 'Name', 'Link'], "<b>Your Deadlines:</b>\n\n", f"\n\n<i>Reminders sent daily at {REMINDER_TIME_TEXT}</i>",
+                  f"<b>Your Deadlines:</b>\n\n<i>No deadlines found! You're all caught up!</i>\n\n<i>Reminders sent daily at {REMINDER_TIME_TEXT}</i>"),
+    'pass': (['Name', 'Pass'], "<b>Works to Pass:</b>\n\n", "\n\n<i>Keep up the good work!</i>",
+             "<b>Works to Pass:</b>\n\n<i>No pending works to pass! Great job!</i>"),
+}
+
+async def view_rows(view):
+    """Rows for a deadline view, projected to the columns it shows"""
+    return await get_columns_async(DEADLINE_VIEWS[view][0])
+
+def render_deadlines_page(records, view, page=0):
+    """One page of a deadline view and its prev/next keyboard"""
+    if isinstance(records, SheetsError):
+        return records.render(), None
+    fields, header, footer, empty = DEADLINE_VIEWS[view]
+    text, page, has_next = get_page(records, fields, page)
+    if not text.strip():
+        return empty, None
+    return f"{header}{text}{footer}", page_keyboard(f"page_{view}", page, has_next)
+
+@dp.callback_query(F.data.startswith('page_'))
+async def deadlines_page_callback(callback: CallbackQuery):
+    view, page = callback.data[len('page_'):].rsplit(':', 1)
+    # Flip through the snapshot already in memory instead of re-reading the sheet
+    records = peek_records()
+    if records is None:
+        records = await view_rows(view)
+    response, keyboard = render_deadlines_page(records, view, int(page))
+    await callback.message.edit_text(response, reply_markup=keyboard, disable_web_page_preview=True)
+    await callback.answer()
+
 @dp.callback_query(F.data=='deadlines')
 async def deadlines_handler(callback: CallbackQuery):
-    text = all_deadlines(get_all_records())
-    if text.strip():
-        response = f"<b>Your Deadlines:</b>\n\n{text}\n\n<i>Reminders sent daily at 12:00 PM</i>"
-    else:
-        response = "<b>Your Deadlines:</b>\n\n<i>No deadlines found! You're all caught up!</i>\n\n<i>Reminders sent daily at 12:00 PM</i>"
+    rows = await view_rows('deadlines')
+    response, keyboard = render_deadlines_page(rows, 'deadlines')
     await callback.message.delete()
-    await callback.message.answer(response, disable_web_page_preview=True)
+    await callback.message.answer(response, reply_markup=keyboard, disable_web_page_preview=True)
     await callback.answer()
 
 @dp.callback_query(F.data=='notify')
 async def notify_handler(callback: CallbackQuery, state: FSMContext):
-    notification_text = """
+    notification_text = f"""
 <b>Notification Setup</b>
 
 To enable notifications, please type 'Yes'
 
 <b>What you'll receive:</b>
-• Daily reminders at 12:00 PM
-• 7 days before deadline
-• 1 day before deadline  
-• On deadline day
-• Auto-deletion notice
+{schedule_lines()}
 
 <i>Type 'Yes' to continue or anything else to cancel.</i>
 """
@@ -280,18 +378,15 @@ To enable notifications, please type 'Yes'
 
 @dp.callback_query(F.data=='pass')
 async def pass_task(callback: CallbackQuery):
-    text = all_deadlines(get_all_records(),['Name','Pass'])
-    if text.strip():
-        response = f"<b>Works to Pass:</b>\n\n{text}\n\n<i>Keep up the good work!</i>"
-    else:
-        response = "<b>Works to Pass:</b>\n\n<i>No pending works to pass! Great job!</i>"
+    rows = await view_rows('pass')
+    response, keyboard = render_deadlines_page(rows, 'pass')
     await callback.message.delete()
-    await callback.message.answer(response)
+    await callback.message.answer(response, reply_markup=keyboard, disable_web_page_preview=True)
     await callback.answer()
 
 @dp.callback_query(F.data=='queues')
 async def queues_handler(callback: CallbackQuery):
-    queues = get_all_queues()
+    queues = await queue_engine.names()
     if queues:
         queue_list = "\n".join([f"• {queue}" for queue in queues])
         response = f"<b>Available Queues:</b>\n\n{queue_list}\n\n<i>Use /queues to see all queues</i>"
@@ -302,19 +397,22 @@ async def queues_handler(callback: CallbackQuery):
     await callback.message.answer(response)
     await callback.answer()
 
-def is_admin(chat_id, username=None):
+@reads
+def get_role(con, chat_id):
+    row = con.execute("SELECT role FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+    return row[0] if row else None
+
+async def is_admin(chat_id, username=None):
     # Check if user is in admin usernames list from environment
     if username and username in getenv("ADMIN_USERNAMES").split(','):
         return True
     
     # Check database role
-    cursor.execute("SELECT role FROM users WHERE chat_id = ?", (chat_id,))
-    row = cursor.fetchone()
-    return row and row[0] == 'admin'
+    return await get_role(chat_id) == 'admin'
 
-@dp.message(F.text=='/add_deadline')
+@commands.command('add_deadline')
 async def add_deadline_handler(message: Message, state: FSMContext):
-    if not is_admin(message.chat.id, message.from_user.username):
+    if not await is_admin(message.chat.id, message.from_user.username):
         error_text = """
 <b>Access Denied</b>
 
@@ -338,37 +436,37 @@ Please enter the deadline in the following format:
 <b>Required:</b>
 • Date (DD.MM.YYYY)
 • Subject/Description
-• Link (optional but recommended)
+• Link
+
+<b>Several at once:</b> send one deadline per line, or upload a CSV or XLSX file with Deadline, Name and Link columns.
 
 <i>Type your deadline details now...</i>
 """
     await message.answer(add_deadline_text)
     await state.set_state(DeadlineForm.waiting_for_deadline)
 
-@dp.message(F.text=='/all')
+@commands.command('all')
 async def message_to_all(message: Message, state: FSMContext):
-    if is_admin(message.chat.id, message.from_user.username):
+    if await is_admin(message.chat.id, message.from_user.username):
         await message.answer(text="Type a message to all users")
         await state.set_state(AllNotify.all_notify)
 
 # Queue Management Commands
-@dp.message(F.text.startswith('/create_queue'))
-async def create_queue_handler(message: Message):
-    if not is_admin(message.chat.id, message.from_user.username):
+@commands.command('create_queue')
+async def create_queue_handler(message: Message, args: str):
+    if not await is_admin(message.chat.id, message.from_user.username):
         await message.answer("<b>Access Denied</b>\n\nOnly admins can create queues.")
         return
     
-    parts = message.text.split(' ', 1)
-    if len(parts) < 2:
+    queue_name = args
+    if not queue_name:
         await message.answer("<b>Usage:</b> <code>/create_queue [queue_name]</code>\n\n<b>Example:</b> <code>/create_queue Math</code>")
         return
     
-    queue_name = parts[1].strip()
-    create_queue(queue_name)
+    await queue_engine.create(queue_name)
     
     # Send notification to all users about the new queue
-    cursor.execute("SELECT chat_id FROM users")
-    chat_ids = [row[0] for row in cursor.fetchall() if row[0]]
+    chat_ids = await get_subscribers()
     
     notification_text = f"""
 <b>📋 New Queue Created!</b>
@@ -384,128 +482,176 @@ A new queue '<b>{queue_name}</b>' has been created by an admin.
 """
     
     # Send notification to all users
-    for chat_id in chat_ids:
-        try:
-            await bot.send_message(chat_id=chat_id, text=notification_text)
-        except Exception as e:
-            print(f"Failed to send notification to chat_id {chat_id}: {e}")
+    report = await broadcaster.broadcast(chat_ids, notification_text)
     
     await message.answer(f"<b>Queue Created!</b>\n\nQueue '<b>{queue_name}</b>' has been created successfully.\n\nAll users have been notified about the new queue.\n\nUsers can now join using: <code>/join_queue {queue_name}</code>")
+    await message.answer(report.summary())
 
-@dp.message(F.text.startswith('/join_queue'))
-async def join_queue_handler(message: Message):
-    parts = message.text.split(' ', 1)
-    if len(parts) < 2:
+@commands.command('join_queue')
+async def join_queue_handler(message: Message, args: str):
+    queue_name = args
+    if not queue_name:
         await message.answer("<b>Usage:</b> <code>/join_queue [queue_name]</code>\n\n<b>Example:</b> <code>/join_queue Math</code>")
         return
     
-    queue_name = parts[1].strip()
     username = message.from_user.username or message.from_user.full_name
-    success, msg = join_queue(queue_name, message.chat.id, username)
+    success, msg = await queue_engine.join(queue_name, message.chat.id, username)
     
     if success:
         await message.answer(f"<b>Successfully Joined!</b>\n\nYou have joined the '<b>{queue_name}</b>' queue.\n\nUse <code>/show_queue {queue_name}</code> to see the current queue.")
     else:
         await message.answer(f"<b>Error:</b> {msg}")
 
-@dp.message(F.text.startswith('/leave_queue'))
-async def leave_queue_handler(message: Message):
-    parts = message.text.split(' ', 1)
-    if len(parts) < 2:
+@commands.command('leave_queue')
+async def leave_queue_handler(message: Message, args: str):
+    queue_name = args
+    if not queue_name:
         await message.answer("<b>Usage:</b> <code>/leave_queue [queue_name]</code>\n\n<b>Example:</b> <code>/leave_queue Math</code>")
         return
     
-    queue_name = parts[1].strip()
-    success, msg = leave_queue(queue_name, message.chat.id)
+    success, msg = await queue_engine.leave(queue_name, message.chat.id)
     
     if success:
         await message.answer(f"<b>Successfully Left!</b>\n\nYou have left the '<b>{queue_name}</b>' queue.")
     else:
         await message.answer(f"<b>Error:</b> {msg}")
 
-@dp.message(F.text.startswith('/show_queue'))
-async def show_queue_handler(message: Message):
-    parts = message.text.split(' ', 1)
-    if len(parts) < 2:
+@commands.command('show_queue')
+async def show_queue_handler(message: Message, args: str):
+    queue_name = args
+    if not queue_name:
         await message.answer("<b>Usage:</b> <code>/show_queue [queue_name]</code>\n\n<b>Example:</b> <code>/show_queue Math</code>")
         return
     
-    queue_name = parts[1].strip()
-    members = get_queue_members(queue_name)
-    
-    if not members:
-        await message.answer(f"<b>Queue: {queue_name}</b>\n\n<i>No members in this queue yet.</i>")
-        return
-    
-    queue_text = f"<b>Queue: {queue_name}</b>\n\n"
-    for i, (chat_id, username, priority, joined_at) in enumerate(members, 1):
-        queue_text += f"{i}. @{username}\n"
-    
-    await message.answer(queue_text)
+    await message.answer(await queue_engine.render(queue_name))
 
-@dp.message(F.text.startswith('/delete_queue'))
-async def delete_queue_handler(message: Message):
-    if not is_admin(message.chat.id, message.from_user.username):
+@commands.command('delete_queue')
+async def delete_queue_handler(message: Message, args: str):
+    if not await is_admin(message.chat.id, message.from_user.username):
         await message.answer("<b>Access Denied</b>\n\nOnly admins can delete queues.")
         return
     
-    parts = message.text.split(' ', 1)
-    if len(parts) < 2:
+    queue_name = args
+    if not queue_name:
         await message.answer("<b>Usage:</b> <code>/delete_queue [queue_name]</code>\n\n<b>Example:</b> <code>/delete_queue Math</code>")
         return
     
-    queue_name = parts[1].strip()
-    success, msg = delete_queue(queue_name)
+    success, msg = await queue_engine.delete(queue_name)
     
     if success:
         await message.answer(f"<b>Queue Deleted!</b>\n\nQueue '<b>{queue_name}</b>' and all its members have been removed.")
     else:
         await message.answer(f"<b>Error:</b> {msg}")
 
-@dp.message(F.text.startswith('/set_priority'))
-async def set_priority_handler(message: Message):
-    if not is_admin(message.chat.id, message.from_user.username):
+@commands.command('set_priority')
+async def set_priority_handler(message: Message, args: str):
+    if not await is_admin(message.chat.id, message.from_user.username):
         await message.answer("<b>Access Denied</b>\n\nOnly admins can set priorities.")
         return
     
-    parts = message.text.split(' ', 3)
-    if len(parts) < 4:
+    parts = args.split(' ', 2)
+    if len(parts) < 3:
         await message.answer("<b>Usage:</b> <code>/set_priority [queue_name] [username] [priority]</code>\n\n<b>Example:</b> <code>/set_priority Math john_doe 5</code>")
         return
     
-    queue_name = parts[1].strip()
-    username = parts[2].strip()
+    queue_name = parts[0].strip()
+    username = parts[1].strip()
     try:
-        priority = int(parts[3].strip())
+        priority = int(parts[2].strip())
     except ValueError:
         await message.answer("<b>Error:</b> Priority must be a number.")
         return
     
-    success, msg = set_priority(queue_name, username, priority)
+    success, msg = await queue_engine.set_priority(queue_name, username, priority)
     await message.answer(f"<b>{'Success!' if success else 'Error:'}</b> {msg}")
 
-@dp.message(F.text.startswith('/shuffle_queue'))
-async def shuffle_queue_handler(message: Message):
-    if not is_admin(message.chat.id, message.from_user.username):
+@commands.command('shuffle_queue')
+async def shuffle_queue_handler(message: Message, args: str):
+    if not await is_admin(message.chat.id, message.from_user.username):
         await message.answer("<b>Access Denied</b>\n\nOnly admins can shuffle queues.")
         return
     
-    parts = message.text.split(' ', 1)
-    if len(parts) < 2:
+    queue_name = args
+    if not queue_name:
         await message.answer("<b>Usage:</b> <code>/shuffle_queue [queue_name]</code>\n\n<b>Example:</b> <code>/shuffle_queue Math</code>")
         return
     
-    queue_name = parts[1].strip()
-    success, msg = shuffle_queue(queue_name)
+    success, msg = await queue_engine.shuffle(queue_name)
+    await message.answer(f"<b>{'Success!' if success else 'Error:'}</b> {msg}")
+
+@commands.command('call_next')
+async def call_next_handler(message: Message, args: str):
+    if not await is_admin(message.chat.id, message.from_user.username):
+        await message.answer("<b>Access Denied</b>\n\nOnly admins can call the next person.")
+        return
+    
+    queue_name = args
+    if not queue_name:
+        await message.answer("<b>Usage:</b> <code>/call_next [queue_name]</code>\n\n<b>Example:</b> <code>/call_next Math</code>")
+        return
+    
+    success, msg, called, next_up = await queue_engine.call_next(queue_name)
+    await message.answer(f"<b>{'Success!' if success else 'Error:'}</b> {msg}")
+    if not success:
+        return
+    
+    try:
+        await bot.send_message(chat_id=called.chat_id, text=f"<b>It's your turn!</b>\n\nYou have been called in the '<b>{queue_name}</b>' queue.")
+        if next_up:
+            await bot.send_message(chat_id=next_up.chat_id, text=f"<b>You're next!</b>\n\nGet ready, you are first in the '<b>{queue_name}</b>' queue.")
+    except Exception as e:
+        print(f"Failed to notify queue members of '{queue_name}': {e}")
+
+@commands.command('move_to_front')
+async def move_to_front_handler(message: Message, args: str):
+    if not await is_admin(message.chat.id, message.from_user.username):
+        await message.answer("<b>Access Denied</b>\n\nOnly admins can reorder queues.")
+        return
+    
+    parts = args.split(' ', 1)
+    if len(parts) < 2:
+        await message.answer("<b>Usage:</b> <code>/move_to_front [queue_name] [username]</code>\n\n<b>Example:</b> <code>/move_to_front Math john_doe</code>")
+        return
+    
+    success, msg = await queue_engine.move_to_front(parts[0].strip(), parts[1].strip())
+    await message.answer(f"<b>{'Success!' if success else 'Error:'}</b> {msg}")
+
+@commands.command('swap')
+async def swap_handler(message: Message, args: str):
+    if not await is_admin(message.chat.id, message.from_user.username):
+        await message.answer("<b>Access Denied</b>\n\nOnly admins can reorder queues.")
+        return
+    
+    parts = args.split(' ', 2)
+    if len(parts) < 3:
+        await message.answer("<b>Usage:</b> <code>/swap [queue_name] [username] [username]</code>\n\n<b>Example:</b> <code>/swap Math john_doe jane_doe</code>")
+        return
+    
+    success, msg = await queue_engine.swap(parts[0].strip(), parts[1].strip(), parts[2].strip())
+    await message.answer(f"<b>{'Success!' if success else 'Error:'}</b> {msg}")
+
+@commands.command('skip')
+async def skip_handler(message: Message, args: str):
+    if not await is_admin(message.chat.id, message.from_user.username):
+        await message.answer("<b>Access Denied</b>\n\nOnly admins can reorder queues.")
+        return
+    
+    if not args:
+        await message.answer("<b>Usage:</b> <code>/skip [queue_name]</code>\n\n<b>Example:</b> <code>/skip Math</code>")
+        return
+    
+    success, msg = await queue_engine.skip(args)
     await message.answer(f"<b>{'Success!' if success else 'Error:'}</b> {msg}")
 
-@dp.message(F.text == '/admin_info')
+@commands.command('admin_info')
 async def admin_info_handler(message: Message):
-    if not is_admin(message.chat.id, message.from_user.username):
+    if not await is_admin(message.chat.id, message.from_user.username):
         await message.answer("<b>Access Denied</b>\n\nOnly admins can view admin information.")
         return
     
     admin_list = ", ".join(getenv("ADMIN_USERNAMES").split(',')) if getenv("ADMIN_USERNAMES") else "None configured"
+    cache = get_cache_stats()
+    sheets_status = get_sheets_status()
     response = f"""
 <b>Admin Configuration</b>
 
@@ -515,6 +661,11 @@ async def admin_info_handler(message: Message):
 • <code>/delete_queue [name]</code> - Delete queue
 • <code>/set_priority [queue] [user] [priority]</code> - Set priority
 • <code>/shuffle_queue [name]</code> - Shuffle queue randomly
+• <code>/call_next [name]</code> - Call the next person
+• <code>/move_to_front [queue] [user]</code> - Move to front
+• <code>/swap [queue] [user] [user]</code> - Swap two members
+• <code>/skip [name]</code> - Send the first person to the back
+• <code>/slow_handlers</code> - Slowest handlers since startup
 
 <b>Admin Setup:</b>
 Admins are configured via ADMIN_USERNAMES in .env file (comma-separated list)
@@ -527,65 +678,64 @@ See ENV_EXAMPLE.md for configuration details
 <b>Your Chat ID:</b> {message.chat.id}
 
 <b>Admin Status:</b> ✅ You are an admin
+
+<b>Sheets Cache:</b> {cache['hits']} hits, {cache['stale_hits']} stale, {cache['misses']} misses (TTL {cache['ttl']:g}s, age {cache['age']}s)
+
+<b>Sheets Circuit:</b> {sheets_status['state']} ({sheets_status['failures']} consecutive failures)
 """
     await message.answer(response)
 
+@commands.command('slow_handlers')
+async def slow_handlers_handler(message: Message):
+    if not await is_admin(message.chat.id, message.from_user.username):
+        await message.answer("<b>Access Denied</b>\n\nOnly admins can view handler timings.")
+        return
+    
+    await message.answer(profiling.stats.render())
+
 # Short Commands for Users
-@dp.message(F.text.startswith('/join'))
-async def join_short_handler(message: Message):
-    parts = message.text.split(' ', 1)
-    if len(parts) < 2:
+@commands.command('join')
+async def join_short_handler(message: Message, args: str):
+    queue_name = args
+    if not queue_name:
         await message.answer("<b>Usage:</b> <code>/join [queue_name]</code>\n\n<b>Example:</b> <code>/join Math</code>")
         return
     
-    queue_name = parts[1].strip()
     username = message.from_user.username or message.from_user.full_name
-    success, msg = join_queue(queue_name, message.chat.id, username)
+    success, msg = await queue_engine.join(queue_name, message.chat.id, username)
     
     if success:
         await message.answer(f"<b>Successfully Joined!</b>\n\nYou have joined the '<b>{queue_name}</b>' queue.\n\nUse <code>/show {queue_name}</code> to see the current queue.")
     else:
         await message.answer(f"<b>Error:</b> {msg}")
 
-@dp.message(F.text.startswith('/leave'))
-async def leave_short_handler(message: Message):
-    parts = message.text.split(' ', 1)
-    if len(parts) < 2:
+@commands.command('leave')
+async def leave_short_handler(message: Message, args: str):
+    queue_name = args
+    if not queue_name:
         await message.answer("<b>Usage:</b> <code>/leave [queue_name]</code>\n\n<b>Example:</b> <code>/leave Math</code>")
         return
     
-    queue_name = parts[1].strip()
-    success, msg = leave_queue(queue_name, message.chat.id)
+    success, msg = await queue_engine.leave(queue_name, message.chat.id)
     
     if success:
         await message.answer(f"<b>Successfully Left!</b>\n\nYou have left the '<b>{queue_name}</b>' queue.")
     else:
         await message.answer(f"<b>Error:</b> {msg}")
 
-@dp.message(F.text.startswith('/show'))
-async def show_short_handler(message: Message):
-    parts = message.text.split(' ', 1)
-    if len(parts) < 2:
+@commands.command('show')
+async def show_short_handler(message: Message, args: str):
+    queue_name = args
+    if not queue_name:
         await message.answer("<b>Usage:</b> <code>/show [queue_name]</code>\n\n<b>Example:</b> <code>/show Math</code>")
         return
     
-    queue_name = parts[1].strip()
-    members = get_queue_members(queue_name)
-    
-    if not members:
-        await message.answer(f"<b>Queue: {queue_name}</b>\n\n<i>No members in this queue yet.</i>")
-        return
-    
-    queue_text = f"<b>Queue: {queue_name}</b>\n\n"
-    for i, (chat_id, username, priority, joined_at) in enumerate(members, 1):
-        queue_text += f"{i}. @{username}\n"
-    
-    await message.answer(queue_text)
+    await message.answer(await queue_engine.render(queue_name))
 
 # Queue Buttons Command
-@dp.message(F.text == '/queues')
+@commands.command('queues')
 async def queues_buttons_handler(message: Message):
-    queues = get_all_queues()
+    queues = await queue_engine.names()
     if not queues:
         await message.answer("<b>No queues available</b>\n\nAdmins can create queues using <code>/create_queue [name]</code>")
         return
@@ -607,7 +757,7 @@ async def queues_buttons_handler(message: Message):
 async def join_queue_callback(callback: CallbackQuery):
     queue_name = callback.data.replace('join_', '')
     username = callback.from_user.username or callback.from_user.full_name
-    success, msg = join_queue(queue_name, callback.message.chat.id, username)
+    success, msg = await queue_engine.join(queue_name, callback.message.chat.id, username)
     
     if success:
         await callback.answer(f"✅ Joined {queue_name} queue!")
@@ -615,35 +765,18 @@ async def join_queue_callback(callback: CallbackQuery):
         await callback.answer(f"❌ {msg}")
     
     # Update the message to show current queue
-    members = get_queue_members(queue_name)
-    if members:
-        queue_text = f"<b>Queue: {queue_name}</b>\n\n"
-        for i, (chat_id, username, priority, joined_at) in enumerate(members, 1):
-            queue_text += f"{i}. @{username}\n"
-    else:
-        queue_text = f"<b>Queue: {queue_name}</b>\n\n<i>No members in this queue yet.</i>"
-    
-    await callback.message.edit_text(queue_text)
+    await callback.message.edit_text(await queue_engine.render(queue_name))
 
 @dp.callback_query(F.data.startswith('show_'))
 async def show_queue_callback(callback: CallbackQuery):
     queue_name = callback.data.replace('show_', '')
-    members = get_queue_members(queue_name)
-    
-    if not members:
-        queue_text = f"<b>Queue: {queue_name}</b>\n\n<i>No members in this queue yet.</i>"
-    else:
-        queue_text = f"<b>Queue: {queue_name}</b>\n\n"
-        for i, (chat_id, username, priority, joined_at) in enumerate(members, 1):
-            queue_text += f"{i}. @{username}\n"
-    
-    await callback.message.edit_text(queue_text)
+    await callback.message.edit_text(await queue_engine.render(queue_name))
     await callback.answer()
 
 @dp.callback_query(F.data.startswith('leave_'))
 async def leave_queue_callback(callback: CallbackQuery):
     queue_name = callback.data.replace('leave_', '')
-    success, msg = leave_queue(queue_name, callback.message.chat.id)
+    success, msg = await queue_engine.leave(queue_name, callback.message.chat.id)
     
     if success:
         await callback.answer(f"✅ Left {queue_name} queue!")
@@ -651,105 +784,215 @@ async def leave_queue_callback(callback: CallbackQuery):
         await callback.answer(f"❌ {msg}")
     
     # Update the message to show current queue
-    members = get_queue_members(queue_name)
-    if members:
-        queue_text = f"<b>Queue: {queue_name}</b>\n\n"
-        for i, (chat_id, username, priority, joined_at) in enumerate(members, 1):
-            queue_text += f"{i}. @{username}\n"
-    else:
-        queue_text = f"<b>Queue: {queue_name}</b>\n\n<i>No members in this queue yet.</i>"
-    
-    await callback.message.edit_text(queue_text)
+    await callback.message.edit_text(await queue_engine.render(queue_name))
 
 # Command handlers for bot menu
-@dp.message(F.text == '/deadlines')
+@commands.command('deadlines')
 async def deadlines_command_handler(message: Message):
-    text = all_deadlines(get_all_records())
-    if text.strip():
-        response = f"<b>Your Deadlines:</b>\n\n{text}\n\n<i>Reminders sent daily at 12:00 PM</i>"
-    else:
-        response = "<b>Your Deadlines:</b>\n\n<i>No deadlines found! You're all caught up!</i>\n\n<i>Reminders sent daily at 12:00 PM</i>"
-    await message.answer(response, disable_web_page_preview=True)
+    rows = await view_rows('deadlines')
+    response, keyboard = render_deadlines_page(rows, 'deadlines')
+    await message.answer(response, reply_markup=keyboard, disable_web_page_preview=True)
 
-@dp.message(F.text == '/notify')
+@commands.command('notify')
 async def notify_command_handler(message: Message, state: FSMContext):
-    notification_text = """
+    notification_text = f"""
 <b>Notification Setup</b>
 
 To enable notifications, please type 'Yes'
 
 <b>What you'll receive:</b>
-• Daily reminders at 12:00 PM
-• 7 days before deadline
-• 1 day before deadline  
-• On deadline day
-• Auto-deletion notice
+{schedule_lines()}
 
 <i>Type 'Yes' to continue or anything else to cancel.</i>
 """
     await message.answer(notification_text)
     await state.set_state(NotificationForm.waiting_for_notification)
 
-@dp.message(F.text == '/pass')
+@commands.command('pass')
 async def pass_command_handler(message: Message):
-    text = all_deadlines(get_all_records(),['Name','Pass'])
-    if text.strip():
-        response = f"<b>Works to Pass:</b>\n\n{text}\n\n<i>Keep up the good work!</i>"
+    rows = await view_rows('pass')
+    response, keyboard = render_deadlines_page(rows, 'pass')
+    await message.answer(response, reply_markup=keyboard, disable_web_page_preview=True)
+
+# Personal reminder settings
+async def current_reminder_prefs(chat_id):
+    """(prefs, custom): the user's settings, or the defaults when they have none"""
+    stored = await get_reminder_prefs(chat_id)
+    return ReminderPrefs.from_json(stored), stored is not None
+
+async def store_reminder_prefs(chat_id, username, prefs):
+    await save_reminder_prefs(chat_id, username, prefs.to_json() if prefs else None)
+    reminder_dispatcher.set(chat_id, prefs)
+
+async def deadline_subjects():
+    records = await get_all_records_async()
+    if isinstance(records, SheetsError):
+        return []
+    return sorted({entry.name for entry in get_deadline_index().entries})[:30]
+
+@commands.command('reminders')
+async def reminders_command_handler(message: Message):
+    prefs, custom = await current_reminder_prefs(message.chat.id)
+    await message.answer(render_prefs(prefs, custom), reply_markup=menu_keyboard())
+
+@dp.callback_query(F.data.startswith('rp_'))
+async def reminder_prefs_callback(callback: CallbackQuery, state: FSMContext):
+    section, chosen, value = callback.data[len('rp_'):].partition(':')
+    chat_id = callback.message.chat.id
+    prefs, custom = await current_reminder_prefs(chat_id)
+    keyboard = menu_keyboard()
+    if section == 'tzinput':
+        await state.set_state(ReminderForm.waiting_for_timezone)
+        await callback.message.answer("Send your time zone name, for example <code>Europe/Moscow</code>")
+        await callback.answer()
+        return
+    if section == 'reset':
+        prefs, custom = ReminderPrefs(), False
+        await store_reminder_prefs(chat_id, callback.from_user.username, None)
+    elif not chosen:
+        # Open a sub-menu
+        if section == 'tz':
+            keyboard = timezone_keyboard()
+        elif section == 'hour':
+            keyboard = hour_keyboard(prefs)
+        elif section == 'off':
+            keyboard = offsets_keyboard(prefs)
+        elif section == 'mute':
+            keyboard = mute_keyboard(prefs, await deadline_subjects())
     else:
-        response = "<b>Works to Pass:</b>\n\n<i>No pending works to pass! Great job!</i>"
-    await message.answer(response)
+        if section == 'tz':
+            prefs.timezone = value if not value or parse_timezone(value) else prefs.timezone
+        elif section == 'hour':
+            prefs.hour = min(max(int(value), 0), 23)
+        elif section == 'off':
+            offset = int(value)
+            prefs.offsets = [o for o in prefs.offsets if o != offset] if offset in prefs.offsets else prefs.offsets + [offset]
+            keyboard = offsets_keyboard(prefs)
+        elif section == 'mute':
+            subjects = await deadline_subjects()
+            name = next((name for name in subjects if subject_token(name) == value), None)
+            if name is not None:
+                prefs.muted = [m for m in prefs.muted if m != name] if name in prefs.muted else prefs.muted + [name]
+            keyboard = mute_keyboard(prefs, subjects)
+        custom = True
+        await store_reminder_prefs(chat_id, callback.from_user.username, prefs)
+    await callback.message.edit_text(render_prefs(prefs, custom), reply_markup=keyboard)
+    await callback.answer()
+
+# All commands above are routed by one lookup in the command table. Registered
+# before the FSM state handlers so commands keep working inside a form.
+@dp.message(commands)
+async def command_dispatcher(message: Message, state: FSMContext, command_handler, command_args):
+    await commands.dispatch(message, state, command_handler, command_args)
+
+async def read_deadline_document(message: Message, existing):
+    """Validate an uploaded CSV/XLSX; returns an ImportReport, or None after telling the admin why not"""
+    document = message.document
+    name = (document.file_name or '').lower()
+    if name.endswith('.csv'):
+        parse = iter_csv
+    elif name.endswith('.xlsx'):
+        parse = iter_xlsx
+    else:
+        await message.answer("<b>Unsupported file</b>\n\nSend a <code>.csv</code> or <code>.xlsx</code> file with Deadline, Name and Link columns.")
+        return None
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer(f"<b>File too large</b>\n\nThe limit is {IMPORT_MAX_FILE_SIZE // 1024} KB.")
+        return None
+    stream = await bot.download(document)
+    try:
+        # Rows are parsed and validated as they are read, off the event loop
+        return await asyncio.to_thread(read_rows, parse(stream), existing)
+    except Exception as e:
+        print(f"Deadline import of {document.file_name} failed: {e}")
+        await message.answer("<b>Could not read the file</b>\n\nCheck that it is a valid CSV or XLSX file.")
+        return None
 
 @dp.message(DeadlineForm.waiting_for_deadline)
 async def process_deadline(message: Message, state: FSMContext):
-    deadline_text = message.text.strip()
-    deadline_add = list(map(str, deadline_text.split(' ')))
-    if re.match(r'\d{2}.\d{2}.\d{4}', deadline_add[0]) is None or len(deadline_add) < 3:
+    records = await get_all_records_async()
+    existing = [] if isinstance(records, SheetsError) else [record_key(record) for record in records]
+    if message.document is not None:
+        report = await read_deadline_document(message, existing)
+        if report is None:
+            return
+    else:
+        report = read_rows(iter_text(message.text or ''), existing)
+
+    if not report.accepted:
         error_text = """
 <b>Invalid Format</b>
 
-Please use the correct format:
+Please use the correct format, one deadline per line:
 <code>DD.MM.YYYY Subject Link</code>
 
 <b>Example:</b>
 <code>25.12.2024 Christmas Assignment https://example.com</code>
 
 <b>Requirements:</b>
-• Date in DD.MM.YYYY format
+• A real date in DD.MM.YYYY format, today or later
 • At least 3 words (date + subject + link)
+
+<i>You can also send a CSV or XLSX file with Deadline, Name and Link columns.</i>
 """
-        await message.answer(error_text)
+        if report.rejected:
+            error_text += "\n" + report.render(added=False)
+        for chunk in split_message(error_text):
+            await message.answer(chunk)
         return
-    
-    add_row(deadline_add)
-    success_text = f"""
+
+    # Remembered first, so a sync running during the append does not announce them
+    added = [row_record(row) for row in report.rows]
+    remembered = await sheet_mirror.remember(added)
+    result = await add_rows_async(report.rows)
+    if isinstance(result, SheetsError):
+        await sheet_mirror.forget(remembered)
+        await message.answer(result.render())
+        for chunk in split_message(report.render(added=False)):
+            await message.answer(chunk)
+        return
+    index = get_deadline_index()
+    if index is not None:
+        # A no-op on other instances; the lease holder's next sync schedules it
+        await reminders.schedule_async(index.entries)
+
+    if len(report.accepted) == 1 and not report.rejected:
+        success_text = f"""
 <b>Deadline Added Successfully!</b>
 
-<b>Added:</b> <code>{deadline_text}</code>
+<b>Added:</b> <code>{html.quote(' '.join(report.rows[0]))}</code>
 
 <i>The deadline has been recorded and users will receive reminders automatically!</i>
 """
-    await message.answer(success_text)
+        await message.answer(success_text)
+    else:
+        for chunk in split_message(report.render()):
+            await message.answer(chunk)
     await state.clear()
 
+@dp.message(ReminderForm.waiting_for_timezone)
+async def process_timezone(message: Message, state: FSMContext):
+    name = (message.text or '').strip()
+    if parse_timezone(name) is None:
+        await message.answer("<b>Unknown time zone</b>\n\nUse a name like <code>Europe/Berlin</code> or <code>Asia/Tokyo</code>.")
+        return
+    prefs, _ = await current_reminder_prefs(message.chat.id)
+    prefs.timezone = name
+    await store_reminder_prefs(message.chat.id, message.from_user.username, prefs)
+    await state.clear()
+    await message.answer(render_prefs(prefs, True), reply_markup=menu_keyboard())
+
 @dp.message(NotificationForm.waiting_for_notification)
 async def process_notification(message: Message, state: FSMContext):
     if message.text == 'Yes':
         role = 'admin' if message.from_user.username in getenv("ADMIN_USERNAMES").split(',') else 'user'
-        cursor.execute("INSERT OR IGNORE INTO users (chat_id, username, role) VALUES (?, ?, ?)", 
-                       (message.chat.id, message.from_user.username, role))
-        if role == 'admin':
-            cursor.execute("UPDATE users SET role = 'admin' WHERE chat_id = ?", (message.chat.id,))
-        con.commit()
+        await subscribe(message.chat.id, message.from_user.username, role)
         
         success_text = f"""
 <b>Notifications Enabled Successfully!</b>
 
 <b>You will now receive:</b>
-• Daily reminders at 12:00 PM
-• 7 days before deadline
-• 1 day before deadline
-• On deadline day
-• Auto-deletion notices
+{schedule_lines()}
 
 <i>You're all set! I'll keep you updated on your deadlines.</i>
 """
@@ -767,64 +1010,77 @@ You won't receive deadline reminders.
 
 @dp.message(AllNotify.all_notify)
 async def process_all_notify(message: Message, state: FSMContext):
-    if is_admin(message.chat.id, message.from_user.username):
+    if await is_admin(message.chat.id, message.from_user.username):
         text = message.text.strip()
-        cursor.execute("SELECT chat_id FROM users")
-        chat_ids = [row[0] for row in cursor.fetchall() if row[0]]
-        for chat_id in chat_ids:
-            await bot.send_message(chat_id=chat_id, text=text)
-        await message.answer("Message sent to all users.")
+        report = await broadcaster.broadcast(await get_subscribers(), text)
+        await message.answer(f"Message sent to all users.\n\n{report.summary()}")
     else:
         await message.answer("You do not have permission to send messages to all users.")
     await state.clear()
 
 async def main():
-    # Set up bot commands menu
-    await setup_bot_commands()
-    
+    # Fails fast on a webhook without a secret, before anything is started
+    webhook_server = WebhookServer(dp, bot) if BOT_MODE == 'webhook' else None
+    queue_engine.db = storage.db
+    fsm_storage.db = storage.db
+    sheet_mirror.db = storage.db
+    await storage.db.read(queue_engine.load)
+    profiling.startup.mark("database")
+    # Answer from the mirror right away, even if Sheets is down
+    print(f"Sheet mirror: {await sheet_mirror.load()} rows")
+    profiling.startup.mark("mirror")
+
+    # Reminder jobs live in the database; only the lease holder runs them
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(check_deadlines, "cron", hour=12, minute=0)
-    scheduler.start()
-    await dp.start_polling(bot)
+    reminders.scheduler = scheduler
+
+    def on_leader_change(is_leader):
+        if is_leader:
+            scheduler.resume()
+            asyncio.create_task(sync_deadlines())
+            asyncio.create_task(start_personal_reminders())
+        else:
+            scheduler.pause()
+            asyncio.create_task(reminder_dispatcher.stop())
+
+    leader = LeaderLock(storage.db, on_change=on_leader_change)
+    sheet_mirror.is_leader = lambda: leader.is_leader
+    reminders.is_leader = lambda: leader.is_leader
+    scheduler.add_jobstore(SQLAlchemyJobStore(url=f"sqlite:///{storage.db.path}"), JOBSTORE)
+    scheduler.add_job(leader.guard(sync_deadlines), "cron", hour=0, minute=5)
+    scheduler.add_job(fsm_storage.sweep, "interval", hours=1)
+    scheduler.add_job(leader.guard(refresh_reminder_prefs), "interval", seconds=PREFS_POLL_INTERVAL)
+    scheduler.start(paused=True)
+    leader.start()
+    sheet_mirror.start()
+    await fsm_storage.start()
+    profiling.startup.mark("scheduler")
+
+    # Sheets and the commands menu are not needed to start answering updates
+    warm_up_task = asyncio.create_task(warm_up())
+    metrics_server = await metrics.start_server()
+    profiling.startup.mark("metrics")
+
+    try:
+        if webhook_server is not None:
+            await webhook_server.run()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        warm_up_task.cancel()
+        await sheet_mirror.stop()
+        await leader.stop()
+        await reminder_dispatcher.stop()
+        scheduler.shutdown(wait=False)
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await fsm_storage.close()
+        storage.db.close()
 
 if __name__=='__main__':
+    profiling.startup.mark("imports")
     database_path = getenv("DATABASE_PATH", "data/bot_data.db")
-    # Ensure the directory exists
-    db_dir = os.path.dirname(database_path)
-    if db_dir and not os.path.exists(db_dir):
-        os.makedirs(db_dir, exist_ok=True)
-    con = sqlite3.connect(database_path)
-    cursor = con.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        chat_id INTEGER UNIQUE,
-        username TEXT,
-        role TEXT
-    )
-''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS queues (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT UNIQUE NOT NULL,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-    )
-''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS queue_members (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        queue_id INTEGER NOT NULL,
-        chat_id INTEGER NOT NULL,
-        username TEXT NOT NULL,
-        priority INTEGER DEFAULT 0,
-        joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (queue_id) REFERENCES queues (id) ON DELETE CASCADE,
-        UNIQUE(queue_id, chat_id)
-    )
-''')
-    
-    con.commit()
+    init_db(database_path)
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
     asyncio.run(main())
\ No newline at end of file
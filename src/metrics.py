@@ -0,0 +1,207 @@
+import threading
+import time
+from bisect import bisect_left
+from os import getenv
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+# Loopback only by default; set 0.0.0.0 to let a scraper on another host in
+METRICS_HOST = getenv("METRICS_HOST", "127.0.0.1")
+# 0 turns the /metrics server off
+METRICS_PORT = int(getenv("METRICS_PORT", "9100"))
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        REGISTRY.append(self)
+
+    def samples(self):
+        """[(suffix, label_values, extra_label, value)]"""
+        return []
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_labels(self.labelnames, values, extra)} {_number(value)}")
+        return '\n'.join(lines)
+
+
+class _Sharded(Metric):
+    """Each thread updates its own shard, so recording needs no lock.
+
+    Scrapes copy and add up the shards; a copy is a single C-level call, which
+    the GIL keeps atomic.
+    """
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._local = threading.local()
+        self._shards = []
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            self._shards.append(shard)
+            return shard
+
+    def _snapshot(self):
+        return [dict(shard) for shard in list(self._shards)]
+
+
+class Counter(_Sharded):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return sum(shard.get(labels, 0) for shard in self._snapshot())
+
+    def samples(self):
+        totals = {}
+        for shard in self._snapshot():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return [('_total', labels, '', value) for labels, value in sorted(totals.items())]
+
+
+class Histogram(_Sharded):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        row = shard.get(labels)
+        if row is None:
+            # Per-bucket counts, then the +Inf bucket, then the sum
+            row = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def samples(self):
+        totals = {}
+        for shard in self._snapshot():
+            for labels, row in shard.items():
+                total = totals.setdefault(labels, [0] * len(row))
+                for i, value in enumerate(list(row)):
+                    total[i] += value
+        samples = []
+        for labels, row in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), row):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(float(bound))
+                samples.append(('_bucket', labels, f'le="{le}"', cumulative))
+            samples.append(('_sum', labels, '', row[-1]))
+            samples.append(('_count', labels, '', cumulative))
+        return samples
+
+
+class Gauge(Metric):
+    """Set from the event loop, or computed at scrape time by a callback"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), func=None):
+        super().__init__(name, help, labels)
+        self.values = {}
+        self.func = func
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def samples(self):
+        values = self.func() if self.func else self.values
+        return [('', labels, '', value) for labels, value in sorted(values.items())]
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in update handlers", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors", "Handlers that raised", ["handler"])
+SHEETS_SECONDS = Histogram("sheets_call_seconds", "Google Sheets calls including retries", ["operation"])
+SHEETS_ERRORS = Counter("sheets_errors", "Failed Google Sheets attempts", ["operation", "reason"])
+API_IN_FLIGHT = Gauge("telegram_requests_in_flight", "Bot API calls awaiting Telegram")
+SENDS = Counter("telegram_sends", "Broadcast sends by outcome", ["result"])
+RATE_LIMITED = Counter("telegram_rate_limited", "RetryAfter answers from Telegram")
+BROADCAST_SECONDS = Histogram("broadcast_seconds", "Duration of a whole broadcast",
+                              buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600))
+DB_SECONDS = Histogram("db_job_seconds", "SQLite jobs by kind and function", ["kind", "job"])
+DB_COMMIT_SECONDS = Histogram("db_commit_seconds", "SQLite group commits")
+DB_BATCH_SIZE = Histogram("db_batch_size", "Writes per group commit", buckets=(1, 2, 5, 10, 25, 50, 100, 256))
+FSM_STATES = Gauge("fsm_states", "Conversations currently in a state", ["state"])
+
+
+def render():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+async def handle_metrics(request):
+    return web.Response(body=render().encode(),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+async def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics on its own port; returns the runner, None when disabled"""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics on {host}:{port}/metrics")
+    return runner
+
+
+def handler_name(event, data):
+    """Name of the function handling event; commands are named after their own handler"""
+    command = data.get("command_handler")
+    if command is not None:
+        return command[0].__name__
+    handler_object = data.get("handler")
+    return handler_object.callback.__name__ if handler_object else type(event).__name__
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Inner middleware timing every handler"""
+
+    async def __call__(self, handler, event, data):
+        name = handler_name(event, data)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import json
+import time
+from os import getenv
+
+from sheets import SheetsError, fetch_records_async, prime_cache
+
+# Seconds between pulls of the sheet into the local mirror
+SYNC_INTERVAL = float(getenv("MIRROR_SYNC_INTERVAL", "60"))
+# A row is an edit of a removed one only if all of these match; links are
+# often shared by several deadlines of one course, so Link alone is not enough
+IDENTITY_FIELDS = ("Name", "Link")
+# Seconds a row remembered before its append may be missing from the sheet
+PENDING_TTL = 600
+
+
+def row_hash(record):
+    """Content hash of a row; values are compared as stripped text"""
+    text = "\x1f".join(f"{key}\x1e{str(value).strip()}" for key, value in sorted(record.items()))
+    return hashlib.sha1(text.encode()).hexdigest()[:20]
+
+
+def _hashed(records):
+    """(hash, position, record) per row; repeats of an identical row are numbered"""
+    seen = {}
+    for position, record in enumerate(records):
+        digest = row_hash(record)
+        count = seen.get(digest, 0)
+        seen[digest] = count + 1
+        yield (f"{digest}:{count}" if count else digest), position, record
+
+
+def _apply_diff(con, records, now):
+    """Bring sheet_rows in line with records; returns (was_empty, added, removed).
+
+    Rows the bot remembered but has not appended yet are kept for up to
+    PENDING_TTL seconds.
+    """
+    old = {digest: (position, record, pending)
+           for digest, position, record, pending in con.execute("SELECT hash, position, record, pending_since FROM sheet_rows")}
+    rows = list(_hashed(records))
+    current = {digest for digest, _, _ in rows}
+    added = [(digest, position, record) for digest, position, record in rows if digest not in old]
+    removed = [digest for digest, (_, _, pending) in old.items()
+               if digest not in current and (pending is None or pending < now - PENDING_TTL)]
+    moved = [(position, digest) for digest, position, _ in rows
+             if digest in old and old[digest][0] != position]
+    seen = [(digest,) for digest in current if digest in old and old[digest][2] is not None]
+    con.executemany("DELETE FROM sheet_rows WHERE hash = ?", [(digest,) for digest in removed])
+    con.executemany("INSERT INTO sheet_rows (hash, position, record) VALUES (?, ?, ?)",
+                    [(digest, position, json.dumps(record, ensure_ascii=False))
+                     for digest, position, record in added])
+    con.executemany("UPDATE sheet_rows SET position = ? WHERE hash = ?", moved)
+    con.executemany("UPDATE sheet_rows SET pending_since = NULL WHERE hash = ?", seen)
+    return (not old, [record for _, _, record in added],
+            [json.loads(old[digest][1]) for digest in removed])
+
+
+def _remember(con, records, now):
+    """Record rows the bot is about to append, so no sync announces them; returns their hashes.
+
+    Copies of a row already in the mirror are numbered after it, as _hashed
+    numbers them once they are at the end of the sheet.
+    """
+    last = con.execute("SELECT MAX(position) FROM sheet_rows").fetchone()[0]
+    if last is None:
+        # Not synced yet; the first sync takes everything in without announcing
+        return []
+    hashes = []
+    for i, record in enumerate(records):
+        digest = row_hash(record)
+        count = con.execute("SELECT COUNT(*) FROM sheet_rows WHERE hash = ? OR hash LIKE ?",
+                            (digest, f"{digest}:%")).fetchone()[0]
+        numbered = f"{digest}:{count}" if count else digest
+        con.execute("INSERT INTO sheet_rows (hash, position, record, pending_since) VALUES (?, ?, ?, ?)",
+                    (numbered, last + 1 + i, json.dumps(record, ensure_ascii=False), now))
+        hashes.append(numbered)
+    return hashes
+
+
+def _forget(con, hashes):
+    con.executemany("DELETE FROM sheet_rows WHERE hash = ? AND pending_since IS NOT NULL",
+                    [(digest,) for digest in hashes])
+
+
+def _read_rows(con):
+    return [json.loads(record) for record, in con.execute("SELECT record FROM sheet_rows ORDER BY position")]
+
+
+def _identity(record):
+    identity = tuple(str(record.get(field, "")).strip() for field in IDENTITY_FIELDS)
+    # Without a name there is nothing to tell deadlines apart by
+    return identity if identity[0] else None
+
+
+def classify(added, removed):
+    """Split added rows into new ones and edits, pairing edits with the row they replaced"""
+    gone = {}
+    for record in removed:
+        identity = _identity(record)
+        if identity is not None:
+            gone.setdefault(identity, record)
+    new, edited = [], []
+    for record in added:
+        previous = gone.pop(_identity(record), None)
+        if previous is not None:
+            edited.append((previous, record))
+        else:
+            new.append(record)
+    return new, edited
+
+
+class SheetMirror:
+    """SQLite copy of the Deadline_checker sheet, kept current by row-hash diffs.
+
+    load() primes the sheets cache from the mirror, so the bot answers from
+    the last synced rows even when Sheets is unreachable at startup. While
+    is_leader() holds, the loop pulls the sheet every interval, writes only
+    the changed rows and calls on_change(new, edited) for rows that did not
+    come from the bot, then after_sync(); other instances reload from the
+    mirror instead. The bot remembers its own rows before appending them and
+    forgets them if the append fails.
+    """
+
+    def __init__(self, db=None, interval=SYNC_INTERVAL, on_change=None, after_sync=None, is_leader=lambda: True):
+        self.db = db
+        self.interval = interval
+        self.on_change = on_change
+        self.after_sync = after_sync
+        self.is_leader = is_leader
+        self._task = None
+
+    async def load(self):
+        """Serve reads from the mirror; returns the number of rows, 0 if it is empty"""
+        records = await self.db.read(_read_rows)
+        if records:
+            prime_cache(records)
+        return len(records)
+
+    async def sync(self):
+        """Pull the sheet and apply the diff; returns (new, edited, removed) or None"""
+        records = await fetch_records_async()
+        if isinstance(records, SheetsError):
+            print(f"Mirror sync skipped: {records.message}")
+            return None
+        was_empty, added, removed = await self.db.write(_apply_diff, records, time.time())
+        prime_cache()
+        new, edited = classify(added, removed)
+        if added or removed:
+            print(f"Mirror sync: {len(new)} new, {len(edited)} edited, {len(removed) - len(edited)} removed")
+        # The first sync fills the mirror; nothing in it is news
+        if not was_empty and (new or edited) and self.on_change is not None:
+            await self.on_change(new, edited)
+        return new, edited, removed
+
+    async def remember(self, records):
+        return await self.db.write(_remember, records, time.time())
+
+    async def forget(self, hashes):
+        if hashes:
+            await self.db.write(_forget, hashes)
+
+    async def _loop(self):
+        while True:
+            try:
+                if self.is_leader():
+                    if await self.sync() is not None and self.after_sync is not None:
+                        await self.after_sync()
+                else:
+                    await self.load()
+            except Exception as e:
+                print(f"Mirror sync failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
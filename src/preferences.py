@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import time
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from os import getenv
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from tzlocal import get_localzone
+
+from reminders import OFFSETS, REMINDER_TIME
+
+# Seconds between checks for settings changed on other instances
+PREFS_POLL_INTERVAL = float(getenv("REMINDER_PREFS_POLL", "10"))
+OFFSET_CHOICES = (14, 7, 3, 2, 1, 0, -1)
+TIMEZONE_CHOICES = (
+    "UTC", "Europe/London", "Europe/Berlin", "Europe/Kyiv", "Europe/Moscow", "Asia/Dubai",
+    "Asia/Tashkent", "Asia/Almaty", "Asia/Kolkata", "Asia/Shanghai", "Asia/Tokyo", "America/New_York",
+)
+
+
+def parse_timezone(name):
+    """IANA zone name -> ZoneInfo, None if unknown"""
+    try:
+        return ZoneInfo(name.strip())
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def subject_token(name):
+    """Short stable id for a subject, small enough for callback_data"""
+    return hashlib.sha1(name.encode()).hexdigest()[:10]
+
+
+@dataclass
+class ReminderPrefs:
+    """A user's reminder settings; '' timezone means the server's own"""
+    timezone: str = ''
+    hour: int = REMINDER_TIME.hour
+    offsets: list = field(default_factory=lambda: list(OFFSETS))
+    muted: list = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, text):
+        """Stored settings; keys this version does not know are ignored"""
+        if not text:
+            return cls()
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in json.loads(text).items() if key in known})
+
+    def to_json(self):
+        return json.dumps(asdict(self), separators=(',', ':'), ensure_ascii=False)
+
+    def zone(self):
+        return parse_timezone(self.timezone) if self.timezone else get_localzone()
+
+    def next_fire(self, after):
+        """First reminder time strictly after the aware datetime `after`"""
+        local = after.astimezone(self.zone())
+        fire = local.replace(hour=self.hour, minute=REMINDER_TIME.minute, second=0, microsecond=0)
+        if fire <= local:
+            # Wall-clock arithmetic in the user's zone, so DST keeps the hour
+            fire += timedelta(days=1)
+        return fire
+
+    def local_date(self, moment):
+        return moment.astimezone(self.zone()).date()
+
+
+class ReminderDispatcher:
+    """Per-user reminder times kept in a min-heap.
+
+    Each user with their own settings has one pending fire time. A change
+    pushes a new entry and leaves the old one to be skipped when it surfaces
+    (lazy deletion), so scheduling and firing cost O(log n) and the loop
+    sleeps until the earliest entry instead of scanning every user.
+    deliver([(chat_id, prefs, fire_at), ...]) gets everyone due at once.
+    version is the highest users.prefs_version applied, for apply().
+    """
+
+    def __init__(self, deliver=None):
+        self.deliver = deliver
+        self.prefs = {}
+        self._next = {}
+        self._heap = []
+        self._wake = asyncio.Event()
+        self._task = None
+        self.version = 0
+
+    def __len__(self):
+        return len(self._next)
+
+    def _push(self, chat_id, prefs, after):
+        fire = prefs.next_fire(after).timestamp()
+        self._next[chat_id] = fire
+        heapq.heappush(self._heap, (fire, chat_id))
+        return fire
+
+    def set(self, chat_id, prefs, now=None):
+        """Schedule chat_id by prefs, or stop reminding it when prefs is None"""
+        if prefs is None:
+            self.prefs.pop(chat_id, None)
+            self._next.pop(chat_id, None)
+            return
+        self.prefs[chat_id] = prefs
+        fire = self._push(chat_id, prefs, now or datetime.now(timezone.utc))
+        if len(self._heap) > 2 * len(self._next) + 64:
+            self._compact()
+        if self._heap[0][0] == fire:
+            self._wake.set()
+
+    def load(self, rows):
+        """Replace everything with (chat_id, prefs_json) rows; heapify is O(n)"""
+        now = datetime.now(timezone.utc)
+        self.prefs = {chat_id: ReminderPrefs.from_json(text) for chat_id, text in rows}
+        self._next = {chat_id: prefs.next_fire(now).timestamp() for chat_id, prefs in self.prefs.items()}
+        self._compact()
+        self._wake.set()
+
+    def apply(self, rows):
+        """Take in (chat_id, prefs_json or None, version) rows changed since self.version"""
+        changed = 0
+        for chat_id, text, version in rows:
+            self.version = max(self.version, version)
+            current = self.prefs.get(chat_id)
+            if (current.to_json() if current else None) == text:
+                continue
+            self.set(chat_id, ReminderPrefs.from_json(text) if text else None)
+            changed += 1
+        return changed
+
+    def _compact(self):
+        self._heap = [(fire, chat_id) for chat_id, fire in self._next.items()]
+        heapq.heapify(self._heap)
+
+    def pop_due(self, now):
+        """Take every user due by timestamp now and queue their next reminder"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire, chat_id = heapq.heappop(self._heap)
+            if self._next.get(chat_id) != fire:
+                continue
+            prefs = self.prefs[chat_id]
+            fire_at = datetime.fromtimestamp(fire, timezone.utc)
+            due.append((chat_id, prefs, fire_at))
+            self._push(chat_id, prefs, fire_at)
+        return due
+
+    async def _run(self):
+        while True:
+            due = self.pop_due(time.time())
+            if due:
+                try:
+                    await self.deliver(due)
+                except Exception as e:
+                    print(f"Personal reminders failed: {e}")
+            self._wake.clear()
+            delay = self._heap[0][0] - time.time() if self._heap else 3600
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(delay, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+# Inline keyboard flow; callback data is 'rp_<section>[:<value>]'
+def _button(text, data):
+    return InlineKeyboardButton(text=text, callback_data=f"rp_{data}")
+
+def _rows(buttons, width):
+    return [buttons[i:i + width] for i in range(0, len(buttons), width)]
+
+def _offset_label(offset):
+    if offset > 0:
+        return f"{offset}d before"
+    return "On the day" if offset == 0 else f"{-offset}d after"
+
+def render_prefs(prefs, custom):
+    zone = prefs.timezone or "server time"
+    offsets = ", ".join(_offset_label(offset) for offset in sorted(prefs.offsets, reverse=True)) or "none"
+    muted = ", ".join(prefs.muted) if prefs.muted else "none"
+    note = "" if custom else "\n\n<i>You are on the default schedule.</i>"
+    return (f"<b>Reminder Settings</b>\n\n"
+            f"<b>Time zone:</b> {zone}\n"
+            f"<b>Time:</b> {prefs.hour:02d}:{REMINDER_TIME.minute:02d}\n"
+            f"<b>Remind me:</b> {offsets}\n"
+            f"<b>Muted subjects:</b> {muted}{note}")
+
+def menu_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [_button("🌍 Time zone", "tz"), _button("⏰ Time", "hour")],
+        [_button("📆 Days", "off"), _button("🔕 Mute subjects", "mute")],
+        [_button("↩️ Reset to default", "reset")],
+    ])
+
+def timezone_keyboard():
+    buttons = [_button(name, f"tz:{name}") for name in TIMEZONE_CHOICES]
+    rows = _rows(buttons, 3)
+    rows.append([_button("Server time", "tz:"), _button("Other…", "tzinput")])
+    rows.append([_button("« Back", "menu")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def hour_keyboard(prefs):
+    buttons = [_button(f"{'• ' if hour == prefs.hour else ''}{hour:02d}", f"hour:{hour}") for hour in range(24)]
+    return InlineKeyboardMarkup(inline_keyboard=_rows(buttons, 6) + [[_button("« Back", "menu")]])
+
+def offsets_keyboard(prefs):
+    buttons = [_button(f"{'✅' if offset in prefs.offsets else '▫️'} {_offset_label(offset)}", f"off:{offset}")
+               for offset in OFFSET_CHOICES]
+    return InlineKeyboardMarkup(inline_keyboard=_rows(buttons, 2) + [[_button("« Back", "menu")]])
+
+def mute_keyboard(prefs, subjects):
+    buttons = [_button(f"{'🔕' if name in prefs.muted else '🔔'} {name[:40]}", f"mute:{subject_token(name)}")
+               for name in subjects]
+    return InlineKeyboardMarkup(inline_keyboard=_rows(buttons, 1) + [[_button("« Back", "menu")]])
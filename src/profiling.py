@@ -0,0 +1,210 @@
+import cProfile
+import os
+import random
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from os import getenv
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from metrics import API_IN_FLIGHT, handler_name
+
+# Fraction of updates run under cProfile, and the total time (ms) above which
+# a sampled profile is written to PROFILE_DIR
+SAMPLE_RATE = float(getenv("PROFILE_SAMPLE_RATE", "0.01"))
+SLOW_MS = float(getenv("PROFILE_SLOW_MS", "1000"))
+PROFILE_DIR = getenv("PROFILE_DIR", "/app/logs")
+PHASES = ("filters", "handler", "db", "sheets", "api")
+
+_current = ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    __slots__ = ("handler", "started", "handler_seconds", "db", "sheets", "api")
+
+    def __init__(self):
+        self.handler = None
+        self.started = time.perf_counter()
+        self.handler_seconds = 0.0
+        self.db = 0.0
+        self.sheets = 0.0
+        self.api = 0.0
+
+    def phases(self, total):
+        """Seconds per phase; 'handler' is the body minus the I/O it waited on"""
+        return {
+            "filters": max(total - self.handler_seconds, 0.0),
+            "handler": max(self.handler_seconds - self.db - self.sheets - self.api, 0.0),
+            "db": self.db,
+            "sheets": self.sheets,
+            "api": self.api,
+        }
+
+
+def record(phase, seconds):
+    """Charge time spent waiting on db, sheets or api to the update being handled"""
+    profile = _current.get()
+    if profile is not None:
+        setattr(profile, phase, getattr(profile, phase) + seconds)
+
+
+class HandlerStats:
+    """Totals per handler since startup, for /slow_handlers"""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def add(self, name, total, phases):
+        entry = self.handlers.get(name)
+        if entry is None:
+            entry = self.handlers[name] = {"count": 0, "total": 0.0, "max": 0.0, **dict.fromkeys(PHASES, 0.0)}
+        entry["count"] += 1
+        entry["total"] += total
+        entry["max"] = max(entry["max"], total)
+        for phase, seconds in phases.items():
+            entry[phase] += seconds
+
+    def top(self, limit=10):
+        """[(name, entry)] slowest first by mean time"""
+        ranked = sorted(self.handlers.items(), key=lambda item: item[1]["total"] / item[1]["count"], reverse=True)
+        return ranked[:limit]
+
+    def render(self, limit=10):
+        if not self.handlers:
+            return "<b>Slow Handlers</b>\n\n<i>No updates handled yet.</i>"
+        lines = ["<b>Slow Handlers</b> (mean / max ms since startup)\n"]
+        for name, entry in self.top(limit):
+            count = entry["count"]
+            split = " ".join(f"{phase} {entry[phase] / count * 1000:.0f}" for phase in PHASES)
+            lines.append(f"<b>{name}</b> ×{count}: {entry['total'] / count * 1000:.0f} / {entry['max'] * 1000:.0f}\n"
+                         f"<code>{split}</code>")
+        return "\n".join(lines)
+
+
+stats = HandlerStats()
+_sampling = False
+
+
+def _process_age():
+    """Seconds since this process was started, 0 where /proc is not available"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 is the start time in clock ticks after boot
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupTimer:
+    """Startup phases measured from process start up to the first handled update"""
+
+    def __init__(self):
+        self.started = time.perf_counter() - _process_age()
+        self.last = self.started
+        self.phases = []
+        self.first_update = None
+
+    def mark(self, phase):
+        """Close the phase that ran since the previous mark"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def add(self, phase, seconds):
+        """A phase that ran concurrently with the others"""
+        self.phases.append((phase, seconds))
+
+    def report(self):
+        split = " ".join(f"{phase}={seconds * 1000:.0f}ms" for phase, seconds in self.phases)
+        print(f"Startup: {split} (ready {(time.perf_counter() - self.started) * 1000:.0f}ms after process start)")
+
+    def update_handled(self):
+        if self.first_update is None:
+            self.first_update = time.perf_counter() - self.started
+            print(f"First update handled {self.first_update * 1000:.0f}ms after process start")
+
+
+startup = StartupTimer()
+
+
+def _dump(profiler, name, total):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{name}-{total * 1000:.0f}ms.prof")
+    profiler.dump_stats(path)
+    return path
+
+
+class UpdateProfiler(BaseMiddleware):
+    """Outer update middleware: times each update by phase and samples cProfile.
+
+    Only one update is profiled at a time, and the profile covers whatever
+    else the event loop ran meanwhile, so treat it as a sample, not an
+    exact per-request trace.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, slow_ms=SLOW_MS):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, handler, event, data):
+        global _sampling
+        profile = RequestProfile()
+        token = _current.set(profile)
+        profiler = None
+        if not _sampling and random.random() < self.sample_rate:
+            _sampling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            return await handler(event, data)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _sampling = False
+            _current.reset(token)
+            startup.update_handled()
+            total = time.perf_counter() - profile.started
+            name = profile.handler or "unhandled"
+            phases = profile.phases(total)
+            stats.add(name, total, phases)
+            if total * 1000 >= self.slow_ms:
+                split = " ".join(f"{phase}={seconds * 1000:.0f}ms" for phase, seconds in phases.items())
+                print(f"Slow update {name}: {total * 1000:.0f}ms ({split})")
+                if profiler is not None:
+                    try:
+                        print(f"Profile written to {_dump(profiler, name, total)}")
+                    except OSError as e:
+                        print(f"Could not write profile: {e}")
+
+
+class HandlerTimer(BaseMiddleware):
+    """Inner middleware marking where filters end and the handler body begins"""
+
+    async def __call__(self, handler, event, data):
+        profile = _current.get()
+        if profile is None:
+            return await handler(event, data)
+        profile.handler = handler_name(event, data)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            profile.handler_seconds += time.perf_counter() - started
+
+
+class ApiTimer(BaseRequestMiddleware):
+    """Session middleware charging Bot API calls to the current update and counting calls in flight"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        API_IN_FLIGHT.inc()
+        try:
+            return await make_request(bot, method)
+        finally:
+            API_IN_FLIGHT.dec()
+            record("api", time.perf_counter() - started)
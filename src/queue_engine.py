@@ -0,0 +1,355 @@
+import functools
+import json
+import random
+from dataclasses import dataclass
+
+from sortedcontainers import SortedList
+
+from storage import next_version
+
+
+@dataclass
+class Member:
+    chat_id: int
+    username: str
+    priority: int
+    position: int
+
+    @property
+    def key(self):
+        # Higher priority first, then explicit position
+        return (-self.priority, self.position, self.chat_id)
+
+
+class QueueState:
+    def __init__(self, name):
+        self.name = name
+        self.order = SortedList()
+        self.members = {}
+        self.by_username = {}
+        self.front = 0
+        self.back = 0
+        self.version = 0
+        self._view = None
+
+    def __len__(self):
+        return len(self.order)
+
+    def add(self, member):
+        self.members[member.chat_id] = member
+        self.by_username.setdefault(member.username, set()).add(member.chat_id)
+        self.order.add(member.key)
+        self.front = min(self.front, member.position)
+        self.back = max(self.back, member.position + 1)
+        self._view = None
+
+    def remove(self, chat_id):
+        member = self.members.pop(chat_id)
+        self.order.remove(member.key)
+        chats = self.by_username.get(member.username)
+        if chats:
+            chats.discard(chat_id)
+            if not chats:
+                del self.by_username[member.username]
+        self._view = None
+        return member
+
+    def find(self, username):
+        """A member by username (usernames are not unique, any match will do)"""
+        chats = self.by_username.get(username.lstrip('@'))
+        return self.members[next(iter(chats))] if chats else None
+
+    def first(self):
+        return self.members[self.order[0][2]] if self.order else None
+
+    def ordered(self):
+        return [self.members[chat_id] for _, _, chat_id in self.order]
+
+    def render(self):
+        """Queue text as shown to users, rebuilt only after a change"""
+        if self._view is None:
+            if self.order:
+                lines = [f"{i}. @{member.username}" for i, member in enumerate(self.ordered(), 1)]
+                self._view = f"<b>Queue: {self.name}</b>\n\n" + "\n".join(lines) + "\n"
+            else:
+                self._view = f"<b>Queue: {self.name}</b>\n\n<i>No members in this queue yet.</i>"
+        return self._view
+
+
+# Write-behind persistence: run on the storage writer thread, in submit order.
+# Every write bumps the queue's version so other instances reload it.
+def _bump(con, queue_name):
+    con.execute("UPDATE queues SET version = ? WHERE name = ?", (next_version(con, "queues"), queue_name))
+
+def _persist_create(con, queue_name):
+    con.execute("INSERT OR IGNORE INTO queues (name) VALUES (?)", (queue_name,))
+    _bump(con, queue_name)
+
+def _persist_delete(con, queue_name):
+    # queue_members rows go with it through ON DELETE CASCADE
+    con.execute("DELETE FROM queues WHERE name = ?", (queue_name,))
+
+def _persist_join(con, queue_name, chat_id, username, priority, position):
+    con.execute("""
+        INSERT OR IGNORE INTO queue_members (queue_id, chat_id, username, priority, position, joined_at)
+        SELECT id, ?, ?, ?, ?, datetime('now') FROM queues WHERE name = ?
+    """, (chat_id, username, priority, position, queue_name))
+    _bump(con, queue_name)
+
+def _persist_leave(con, queue_name, chat_id):
+    con.execute("""
+        DELETE FROM queue_members
+        WHERE chat_id = ? AND queue_id = (SELECT id FROM queues WHERE name = ?)
+    """, (chat_id, queue_name))
+    _bump(con, queue_name)
+
+def _persist_priority(con, queue_name, username, priority):
+    con.execute("""
+        UPDATE queue_members SET priority = ?
+        WHERE username = ? AND queue_id = (SELECT id FROM queues WHERE name = ?)
+    """, (priority, username, queue_name))
+    _bump(con, queue_name)
+
+def _persist_place(con, queue_name, places):
+    """places: [(chat_id, priority, position), ...]"""
+    con.executemany("""
+        UPDATE queue_members SET priority = ?, position = ?
+        WHERE chat_id = ? AND queue_id = (SELECT id FROM queues WHERE name = ?)
+    """, [(priority, position, chat_id, queue_name) for chat_id, priority, position in places])
+    _bump(con, queue_name)
+
+def _persist_order(con, queue_name, chat_ids):
+    # One statement: each member's new position is its index in the JSON array
+    con.execute("""
+        UPDATE queue_members
+        SET position = (SELECT key FROM json_each(?) WHERE value = queue_members.chat_id)
+        WHERE queue_id = (SELECT id FROM queues WHERE name = ?)
+    """, (json.dumps(chat_ids), queue_name))
+    _bump(con, queue_name)
+
+def _read_queue(con, queue_id, name, version):
+    queue = QueueState(name)
+    queue.version = version
+    members = con.execute("SELECT chat_id, username, priority, position FROM queue_members WHERE queue_id = ?", (queue_id,))
+    for chat_id, username, priority, position in members:
+        queue.add(Member(chat_id, username, priority or 0, position))
+    return queue
+
+def _read_changed(con, versions, queue_name=None):
+    """(queues whose version differs from versions, names no longer in the database).
+
+    queue_name limits the check to that queue. Each version is read before
+    its members, so a write landing in between only causes another reload.
+    """
+    if queue_name is None:
+        rows = con.execute("SELECT id, name, version FROM queues ORDER BY id").fetchall()
+    else:
+        rows = con.execute("SELECT id, name, version FROM queues WHERE name = ?", (queue_name,)).fetchall()
+    changed = {name: _read_queue(con, queue_id, name, version)
+               for queue_id, name, version in rows if versions.get(name) != version}
+    present = {name for _, name, _ in rows}
+    names = list(versions) if queue_name is None else [queue_name]
+    return changed, [name for name in names if name in versions and name not in present]
+
+
+def _read_through(method):
+    """Refresh the queue from the database before running method on it"""
+    @functools.wraps(method)
+    async def wrapper(self, queue_name, *args):
+        await self.refresh(queue_name)
+        return method(self, queue_name, *args)
+    return wrapper
+
+
+class QueueEngine:
+    """All queues held in memory, written behind to SQLite.
+
+    Members are ordered by (-priority, position) in a SortedList, so join,
+    leave, lookup, re-prioritize, call-next, move-to-front, swap and skip are
+    all O(log n). Mutations hand their SQL to the storage writer without
+    waiting for it. Each write bumps the queue's version; before every call
+    the engine reads the version and reloads a queue another instance changed.
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self.queues = {}
+        self._last_write = None
+        self._writes = 0
+
+    def load(self, con):
+        """Fill the engine from the database (runs once at startup)"""
+        self.queues, _ = _read_changed(con, {})
+
+    async def refresh(self, queue_name=None):
+        """Reload queues changed by other instances; None checks every queue"""
+        if self.db is None or self._writing():
+            return
+        writes = self._writes
+        versions = {name: queue.version for name, queue in self.queues.items()}
+        changed, gone = await self.db.read(_read_changed, versions, queue_name)
+        # Local changes made meanwhile win; the next call checks again
+        if not (changed or gone) or self._writes != writes or self._writing():
+            return
+        for name in gone:
+            del self.queues[name]
+        self.queues.update(changed)
+
+    def _writing(self):
+        return self._last_write is not None and not self._last_write.done()
+
+    def _persist(self, func, *args):
+        self._writes += 1
+        if self.db is None:
+            return
+        future = self.db.submit(func, *args)
+        future.add_done_callback(_log_failure)
+        # The writer runs jobs in submit order, so the last one finishing means all have
+        self._last_write = future
+
+    def _place(self, queue, *moves):
+        """Re-key members: moves are (member, priority, position)"""
+        for member, priority, position in moves:
+            queue.remove(member.chat_id)
+            member.priority = priority
+            member.position = position
+            queue.add(member)
+        self._persist(_persist_place, queue.name,
+                      [(member.chat_id, member.priority, member.position) for member, _, _ in moves])
+
+    async def names(self):
+        await self.refresh()
+        return list(self.queues)
+
+    @_read_through
+    def create(self, queue_name):
+        if queue_name not in self.queues:
+            self.queues[queue_name] = QueueState(queue_name)
+            self._persist(_persist_create, queue_name)
+
+    @_read_through
+    def delete(self, queue_name):
+        if self.queues.pop(queue_name, None) is None:
+            return False, "Queue not found"
+        self._persist(_persist_delete, queue_name)
+        return True, "Queue deleted successfully"
+
+    @_read_through
+    def join(self, queue_name, chat_id, username):
+        queue = self.queues.get(queue_name)
+        if queue is None:
+            return False, "Queue not found"
+        if chat_id in queue.members:
+            return False, "You are already in this queue"
+        position = queue.back
+        queue.add(Member(chat_id, username, 0, position))
+        self._persist(_persist_join, queue_name, chat_id, username, 0, position)
+        return True, "Successfully joined the queue"
+
+    @_read_through
+    def leave(self, queue_name, chat_id):
+        queue = self.queues.get(queue_name)
+        if queue is None:
+            return False, "Queue not found"
+        if chat_id in queue.members:
+            queue.remove(chat_id)
+            self._persist(_persist_leave, queue_name, chat_id)
+        return True, "Successfully left the queue"
+
+    @_read_through
+    def set_priority(self, queue_name, username, priority):
+        queue = self.queues.get(queue_name)
+        if queue is None:
+            return False, "Queue not found"
+        username = username.lstrip('@')
+        chat_ids = list(queue.by_username.get(username, ()))
+        if not chat_ids:
+            return False, "User not found in queue"
+        for chat_id in chat_ids:
+            member = queue.remove(chat_id)
+            member.priority = priority
+            queue.add(member)
+        self._persist(_persist_priority, queue_name, username, priority)
+        return True, f"Priority set to {priority} for {username}"
+
+    @_read_through
+    def shuffle(self, queue_name):
+        queue = self.queues.get(queue_name)
+        if queue is None:
+            return False, "Queue not found"
+        if len(queue) < 2:
+            return False, "Need at least 2 members to shuffle"
+        members = queue.ordered()
+        random.shuffle(members)
+        queue.order.clear()
+        for position, member in enumerate(members):
+            member.position = position
+            queue.order.add(member.key)
+        queue.front, queue.back = 0, len(members)
+        queue._view = None
+        self._persist(_persist_order, queue_name, [member.chat_id for member in members])
+        return True, f"Queue '{queue_name}' has been shuffled randomly"
+
+    @_read_through
+    def call_next(self, queue_name):
+        """Remove the member at the front; returns (success, msg, called, next_up)"""
+        queue = self.queues.get(queue_name)
+        if queue is None:
+            return False, "Queue not found", None, None
+        called = queue.first()
+        if called is None:
+            return False, "The queue is empty", None, None
+        queue.remove(called.chat_id)
+        self._persist(_persist_leave, queue_name, called.chat_id)
+        return True, f"Called @{called.username}", called, queue.first()
+
+    @_read_through
+    def move_to_front(self, queue_name, username):
+        queue = self.queues.get(queue_name)
+        if queue is None:
+            return False, "Queue not found"
+        member = queue.find(username)
+        if member is None:
+            return False, "User not found in queue"
+        # Take the top priority too, otherwise higher-priority members stay ahead
+        first = queue.first()
+        self._place(queue, (member, max(member.priority, first.priority), queue.front - 1))
+        return True, f"@{member.username} moved to the front of '{queue_name}'"
+
+    @_read_through
+    def swap(self, queue_name, username_a, username_b):
+        queue = self.queues.get(queue_name)
+        if queue is None:
+            return False, "Queue not found"
+        a, b = queue.find(username_a), queue.find(username_b)
+        if a is None or b is None:
+            return False, "User not found in queue"
+        if a is b:
+            return False, "Pick two different members"
+        self._place(queue, (a, b.priority, b.position), (b, a.priority, a.position))
+        return True, f"Swapped @{a.username} and @{b.username}"
+
+    @_read_through
+    def skip(self, queue_name):
+        """Send the member at the front to the back of their priority group"""
+        queue = self.queues.get(queue_name)
+        if queue is None:
+            return False, "Queue not found"
+        if len(queue) < 2:
+            return False, "Need at least 2 members to skip"
+        member = queue.first()
+        self._place(queue, (member, member.priority, queue.back))
+        return True, f"@{member.username} was skipped"
+
+    @_read_through
+    def render(self, queue_name):
+        queue = self.queues.get(queue_name)
+        if queue is None:
+            return f"<b>Queue: {queue_name}</b>\n\n<i>No members in this queue yet.</i>"
+        return queue.render()
+
+
+def _log_failure(future):
+    error = future.exception()
+    if error is not None:
+        print(f"Queue write-behind failed: {error}")
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+from datetime import date, datetime, time
+from os import getenv
+
+# Days before the deadline to remind; a negative last offset is the expiry
+# notice, after which the row is deleted from the sheet
+OFFSETS = [int(offset) for offset in getenv("REMINDER_OFFSETS", "7,1,0,-1").split(',')]
+REMINDER_TIME = time(*map(int, getenv("REMINDER_TIME", "12:00").split(':')))
+# A reminder missed while the bot was down is still sent this many seconds late
+MISFIRE_GRACE = int(getenv("REMINDER_GRACE", "21600"))
+# Reminders firing within this many seconds of each other share one digest
+BATCH_DELAY = float(getenv("REMINDER_BATCH_DELAY", "2"))
+JOBSTORE = "deadlines"
+
+SECTION_NAMES = {7: 'week', 1: 'tomorrow', 0: 'today', -1: 'expired'}
+REMINDER_TIME_TEXT = REMINDER_TIME.strftime("%H:%M")
+
+
+def _offset_phrase(offset):
+    if offset == 0:
+        return "on the deadline day"
+    days = f"{abs(offset)} day{'s' if abs(offset) != 1 else ''}"
+    return f"{days} before" if offset > 0 else f"{days} after"
+
+
+def schedule_lines(offsets=OFFSETS):
+    """Bullet lines describing the default reminder schedule for user-facing texts"""
+    lines = [f"• Daily reminders at {REMINDER_TIME_TEXT}"]
+    for offset in sorted(offsets, reverse=True):
+        if offset < 0 and offset == min(offsets):
+            lines.append("• Auto-deletion notice")
+        else:
+            phrase = _offset_phrase(offset)
+            lines.append(f"• {phrase[0].upper()}{phrase[1:]}{' deadline' if offset else ''}")
+    return "\n".join(lines)
+
+
+def schedule_sentence(offsets=OFFSETS):
+    """'7 days before, 1 day before, on the deadline day' for the configured offsets"""
+    expiry = min(offsets) if min(offsets) < 0 else None
+    return ", ".join(_offset_phrase(offset) for offset in sorted(offsets, reverse=True) if offset != expiry)
+
+
+def job_id(key, offset):
+    digest = hashlib.sha1(repr(tuple(key)).encode()).hexdigest()[:16]
+    return f"deadline:{digest}:{offset}"
+
+
+class ReminderScheduler:
+    """One APScheduler date job per deadline and offset.
+
+    Jobs are kept in the persistent JOBSTORE, so reminders due while the bot
+    was down run after a restart within MISFIRE_GRACE. Jobs that fire
+    together are gathered for BATCH_DELAY and handed to deliver(sections,
+    expired_keys) as one digest.
+
+    Only the lease holder writes jobs: APScheduler does not notice jobs that
+    another process adds to a shared store. Other instances leave new
+    deadlines to the holder's next sheet sync.
+    """
+
+    def __init__(self, scheduler=None, offsets=OFFSETS, at=REMINDER_TIME,
+                 grace=MISFIRE_GRACE, batch_delay=BATCH_DELAY):
+        self.scheduler = scheduler
+        self.offsets = offsets
+        self.at = at
+        self.grace = grace
+        self.batch_delay = batch_delay
+        self.expiry_offset = min(offsets) if min(offsets) < 0 else None
+        self.deliver = None
+        self.is_leader = lambda: True
+        self._sections = {}
+        self._expired = []
+        self._flush_task = None
+        self._deliveries = set()
+
+    def run_times(self, ordinal):
+        """[(offset, datetime)] at which a deadline on ordinal is reminded"""
+        return [(offset, datetime.combine(date.fromordinal(ordinal - offset), self.at))
+                for offset in self.offsets]
+
+    def schedule(self, entries, prune=False):
+        """Add jobs for DeadlineEntry items that are not scheduled yet.
+
+        Only future run times are added: past ones either already ran or are
+        still in the jobstore waiting to be caught up. With prune, jobs for
+        deadlines missing from entries are removed.
+        """
+        if self.scheduler is None or not self.is_leader():
+            return 0
+        existing = {job.id for job in self.scheduler.get_jobs(jobstore=JOBSTORE)}
+        wanted = set()
+        now = datetime.now()
+        added = 0
+        for entry in entries:
+            for offset, run_at in self.run_times(entry.ordinal):
+                jid = job_id(entry.key, offset)
+                wanted.add(jid)
+                if jid in existing or run_at <= now:
+                    continue
+                self.scheduler.add_job(
+                    send_reminder, 'date', run_date=run_at, id=jid, jobstore=JOBSTORE,
+                    args=[list(entry.key), entry.name, entry.ordinal, offset],
+                    misfire_grace_time=self.grace, coalesce=True,
+                )
+                added += 1
+        if prune:
+            for jid in existing - wanted:
+                self.scheduler.remove_job(jid, jobstore=JOBSTORE)
+        return added
+
+    async def schedule_async(self, entries, prune=False):
+        """schedule() on a worker thread; the jobstore does blocking SQL"""
+        if self.scheduler is None or not self.is_leader():
+            return 0
+        return await asyncio.to_thread(self.schedule, list(entries), prune)
+
+    async def enqueue(self, key, name, ordinal, offset):
+        section = SECTION_NAMES.get(offset, offset)
+        self._sections.setdefault(section, []).append((date.fromordinal(ordinal), name))
+        if offset == self.expiry_offset:
+            self._expired.append(tuple(key))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+            # Keep a reference until the delivery is done, not just the wait
+            self._deliveries.add(self._flush_task)
+            self._flush_task.add_done_callback(self._deliveries.discard)
+
+    async def _flush(self):
+        await asyncio.sleep(self.batch_delay)
+        sections, expired = self._sections, self._expired
+        self._sections, self._expired, self._flush_task = {}, [], None
+        for items in sections.values():
+            items.sort()
+        try:
+            await self.deliver(sections, expired)
+        except Exception as e:
+            print(f"Reminder delivery failed ({len(expired)} expired rows not deleted): {e}")
+
+
+reminders = ReminderScheduler()
+
+
+async def send_reminder(key, name, ordinal, offset):
+    """Job entry point; referenced by module path from the persistent jobstore"""
+    await reminders.enqueue(key, name, ordinal, offset)
@@ -1,60 +1,552 @@
+import asyncio
 import gspread
-from google.auth.exceptions import TransportError
-from datetime import datetime
+import random
+import requests
+import threading
+import time
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from google.auth.exceptions import GoogleAuthError, TransportError
+from gspread.utils import rowcol_to_a1
 from os import getenv
 
+from deadline_index import DeadlineIndex, parse_ordinal
+from metrics import SHEETS_ERRORS, SHEETS_SECONDS
+from profiling import record
+
 gc = None
 sh = None
 worksheet = None
+_init_lock = threading.Lock()
+
+# The spreadsheet ID from its URL; without it the sheet is looked up by title
+SPREADSHEET_KEY = getenv("SPREADSHEET_KEY", "")
+SPREADSHEET_NAME = getenv("SPREADSHEET_NAME", "Deadline_checker")
+# Columns the bot reads; other columns of the sheet are never downloaded
+SHEET_COLUMNS = tuple(getenv("SHEETS_COLUMNS", "Deadline,Name,Link,Pass").split(','))
+_column_letters = {}
+
+# Records cache: reads are served from memory for CACHE_TTL seconds, then for
+# another CACHE_STALE seconds the stale copy is returned while a background
+# thread re-reads the sheet. Past that a read blocks on a fresh fetch.
+CACHE_TTL = float(getenv("SHEETS_CACHE_TTL", "60"))
+CACHE_STALE = float(getenv("SHEETS_CACHE_STALE", "300"))
+
+_cache = {"records": None, "fetched_at": 0.0}
+_cache_lock = threading.Lock()
+_refreshing = False
+# Set once a local mirror keeps the cache current; reads then never wait on Sheets
+_mirrored = False
+cache_stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "invalidations": 0}
+
+# gspread is blocking, so the async API runs it on a small dedicated pool.
+# The pool size is the concurrency limit towards Google; SHEETS_TIMEOUT bounds
+# how long a handler waits (queueing included) before treating it as a failure.
+SHEETS_MAX_WORKERS = int(getenv("SHEETS_MAX_WORKERS", "4"))
+SHEETS_TIMEOUT = float(getenv("SHEETS_TIMEOUT", "20"))
+_executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS, thread_name_prefix="sheets")
+
+# Retries back off exponentially with full jitter. After BREAKER_THRESHOLD
+# consecutive failed calls the breaker opens and calls fail fast for
+# BREAKER_COOLDOWN seconds; reads are then answered from the last good snapshot.
+BACKOFF_BASE = float(getenv("SHEETS_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(getenv("SHEETS_BACKOFF_MAX", "10"))
+BREAKER_THRESHOLD = int(getenv("SHEETS_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(getenv("SHEETS_BREAKER_COOLDOWN", "60"))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
 
 def _init_sheets():
-    """Initialize Google Sheets connection lazily"""
+    """Connect on first use, from a Sheets worker thread.
+
+    Opening by SPREADSHEET_KEY is one metadata request; opening by title
+    first searches Drive for it. The client keeps one authorized session,
+    so later calls reuse its connections.
+    """
     global gc, sh, worksheet
-    if gc is None:
+    if worksheet is not None:
+        return
+    with _init_lock:
+        if worksheet is not None:
+            return
         credentials_file = getenv("CREDENTIALS_FILE")
         if not credentials_file:
             raise ValueError("CREDENTIALS_FILE environment variable is not set")
-        gc = gspread.service_account(filename=credentials_file)
-sh = gc.open("Deadline_checker")
-worksheet = sh.sheet1
+        started = time.perf_counter()
+        if gc is None:
+            gc = gspread.service_account(filename=credentials_file)
+        if sh is None:
+            sh = gc.open_by_key(SPREADSHEET_KEY) if SPREADSHEET_KEY else gc.open(SPREADSHEET_NAME)
+        opened = time.perf_counter()
+        worksheet = sh.sheet1
+        print(f"Sheets connected: open {(opened - started) * 1000:.0f}ms, "
+              f"worksheet {(time.perf_counter() - opened) * 1000:.0f}ms")
+        if not SPREADSHEET_KEY:
+            print(f"Set SPREADSHEET_KEY={sh.id} to skip the lookup by title")
 
-def add_row(new_row_data, retries=3):
-    _init_sheets()
-    for attempt in range(retries):
-        try:
-            worksheet.append_row(new_row_data)
-            print(f"Row appended to 'Deadline_checker'")
-            return True
-        except (gspread.exceptions.APIError, TransportError) as e:
-            print(f"Attempt {attempt+1} failed: {e}")
-            if attempt < retries - 1:
-                pass
-            else:
-                return False
-
-def get_all_records(retries=3):
-    _init_sheets()
-    for attempt in range(retries):
-        try:
-            records = worksheet.get_all_records()
-            return sorted(records, key=lambda r: datetime.strptime(r["Deadline"], "%d.%m.%Y"))
-        except (gspread.exceptions.APIError, TransportError) as e:
-            print(f"Attempt {attempt+1} failed: {e}")
-            if attempt < retries - 1:
-                pass
-            else:
-                return None
-
-def delete_row(row_number, retries=3):
-    _init_sheets()
+@dataclass
+class SheetsError:
+    """Failed Sheets operation; falsy so `if add_rows(...)` style checks keep working"""
+    operation: str
+    message: str
+    retry_after: float = None
+
+    def __bool__(self):
+        return False
+
+    def render(self):
+        text = "<b>Google Sheets is unavailable right now</b>\n\n"
+        if self.retry_after:
+            text += f"<i>Please try again in about {int(self.retry_after) + 1} seconds.</i>"
+        else:
+            text += "<i>Please try again a bit later.</i>"
+        return text
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """False while open; after the cooldown lets a single trial call through"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._trial and time.monotonic() - self.opened_at >= self.cooldown:
+                self._trial = True
+                return True
+            return False
+
+    def remaining(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    print(f"Sheets circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if self._trial else "open"
+
+
+breaker = CircuitBreaker()
+_last_good = None
+_index = None
+_header = None
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+# API and network errors (requests errors are OSErrors), plus setup errors that
+# retrying does not fix: missing or unreadable credentials, a spreadsheet that
+# is not found or not shared with the service account
+SHEETS_EXCEPTIONS = (gspread.exceptions.GSpreadException, GoogleAuthError, OSError, ValueError)
+
+def _is_retryable(error):
+    if isinstance(error, gspread.exceptions.APIError):
+        return getattr(error, "code", None) in RETRYABLE_STATUS
+    return isinstance(error, (TransportError, requests.RequestException, ConnectionError, TimeoutError))
+
+def _call(operation, func, retries=3):
+    """Run func with backoff, jitter and the circuit breaker; return its result or a SheetsError"""
+    if not breaker.allow():
+        SHEETS_ERRORS.inc(operation, "circuit_open")
+        return SheetsError(operation, "circuit open", breaker.remaining())
+    started = time.perf_counter()
+    try:
+        return _attempt(operation, func, retries)
+    finally:
+        SHEETS_SECONDS.observe(time.perf_counter() - started, operation)
+
+def _attempt(operation, func, retries):
+    last_error = None
     for attempt in range(retries):
         try:
-            worksheet.delete_rows(row_number)
-            print(f"Row {row_number} deleted from 'Deadline_checker'")
-            return True
-        except (gspread.exceptions.APIError, TransportError) as e:
-            print(f"Attempt {attempt+1} failed: {e}")
-            if attempt < retries - 1:
-                pass
-            else:
-                return False
\ No newline at end of file
+            _init_sheets()
+            result = func()
+            breaker.success()
+            return result
+        except SHEETS_EXCEPTIONS as e:
+            print(f"{operation}: attempt {attempt+1} failed: {e}")
+            last_error = e
+            retryable = _is_retryable(e)
+            SHEETS_ERRORS.inc(operation, "retryable" if retryable else "fatal")
+            if not retryable or attempt == retries - 1:
+                break
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            time.sleep(min(delay, BACKOFF_MAX))
+    breaker.failure()
+    return SheetsError(operation, str(last_error), _retry_after(last_error))
+
+def connect(retries=3):
+    """Open the spreadsheet ahead of the first read; True or a SheetsError"""
+    return _call("connect", lambda: True, retries)
+
+def get_sheets_status():
+    """Breaker state and consecutive failure count for admin output"""
+    return {"state": breaker.state, "failures": breaker.failures, "retry_in": round(breaker.remaining())}
+
+def invalidate_cache():
+    """Drop the cached records so the next read goes to Sheets"""
+    with _cache_lock:
+        _cache["records"] = None
+        _cache["fetched_at"] = 0.0
+        cache_stats["invalidations"] += 1
+
+def get_cache_stats():
+    """Return cache counters and the age of the cached snapshot"""
+    with _cache_lock:
+        stats = dict(cache_stats)
+        if _cache["records"] is not None:
+            stats["age"] = round(time.monotonic() - _cache["fetched_at"], 1)
+        else:
+            stats["age"] = None
+        stats["ttl"] = CACHE_TTL
+    return stats
+
+def get_deadline_index():
+    """The DeadlineIndex behind the cached records, None before the first read"""
+    with _cache_lock:
+        return _index
+
+def _patch_index(update):
+    """Apply a successful write to a copy of the cached index and swap it in.
+
+    Readers on the event loop keep whichever index they fetched, and it never
+    changes under them.
+    """
+    global _last_good, _index
+    with _cache_lock:
+        if _index is not None and _cache["records"] is not None:
+            patched = _index.copy()
+            update(patched)
+            _index = patched
+            _cache["records"] = _last_good = patched.records()
+            return
+    invalidate_cache()
+
+# Rows given to add_rows list their values in this order
+ROW_FIELDS = ("Deadline", "Name", "Link", "Pass")
+
+def row_record(row):
+    """The record get_all_records would return for row"""
+    values = dict(zip(ROW_FIELDS, row))
+    return {field: values.get(field, "") for field in SHEET_COLUMNS}
+
+def _sheet_row(row):
+    """row laid out under the sheet's own header, so columns may be in any order"""
+    if _header is None:
+        _read_columns(())
+    values = dict(zip(ROW_FIELDS, row))
+    positions = {field: _header.index(field) for field in values if field in _header}
+    if not positions:
+        return list(row)
+    cells = [""] * (max(positions.values()) + 1)
+    for field, position in positions.items():
+        cells[position] = values[field]
+    return cells
+
+
+def add_rows(rows, retries=3):
+    """Append rows in one API call"""
+    def append():
+        worksheet.append_rows([_sheet_row(row) for row in rows])
+        print(f"{len(rows)} rows appended to 'Deadline_checker'")
+        records = [row_record(row) for row in rows]
+
+        def add_all(index):
+            for record in records:
+                index.add(record)
+
+        _patch_index(add_all)
+        return True
+    return _call("add_rows", append, retries)
+
+
+def _column_letter(position):
+    """0-based column position -> A1 column letters"""
+    return rowcol_to_a1(1, position + 1).rstrip("0123456789")
+
+def _read_columns(fields):
+    """Every data row as a tuple of fields, in sheet order (row n at index n - 2).
+
+    The header and only the wanted columns come back in one values.batchGet.
+    Column letters are remembered; if the header shows the columns moved,
+    they are looked up again and read a second time. Missing columns read
+    as ''. The header row is kept for laying out appended rows.
+    """
+    global _header
+    for _ in range(2):
+        present = [field for field in fields if field in _column_letters]
+        columns = worksheet.batch_get(["1:1"] + [f"{_column_letters[field]}:{_column_letters[field]}" for field in present],
+                                      major_dimension="COLUMNS")
+        header = [column[0] if column else "" for column in columns[0]]
+        _header = header
+        letters = {field: _column_letter(header.index(field)) for field in fields if field in header}
+        if letters == {field: _column_letters[field] for field in present}:
+            break
+        for field in fields:
+            _column_letters.pop(field, None)
+        _column_letters.update(letters)
+    values = {field: column[0][1:] if column else [] for field, column in zip(present, columns[1:])}
+    length = max((len(column) for column in values.values()), default=0)
+    padded = [values.get(field, []) + [""] * (length - len(values.get(field, []))) for field in fields]
+    return list(zip(*padded))
+
+def _current_index(retries=3):
+    """The cached index while reads may be answered from it (refreshing it when stale), else None"""
+    if _lookup_cache(retries, False) is None:
+        return None
+    with _cache_lock:
+        return _index
+
+def _window_ordinals(window):
+    first, last = window
+    return first.toordinal(), last.toordinal()
+
+def _project(index, fields, window):
+    """Rows of index as tuples of fields, in date order, with undated rows last unless a window is given"""
+    if window is None:
+        records = index.records()
+    else:
+        records = [entry.record for entry in index.between(*_window_ordinals(window))]
+    rows = (tuple(str(record.get(field, "")) for field in fields) for record in records)
+    return [row for row in rows if any(row)]
+
+def get_columns(fields, window=None, retries=3):
+    """Non-empty rows as tuples of fields, in date order like get_all_records.
+
+    window=(first, last) keeps only rows whose Deadline falls within those
+    dates (inclusive); Sheets cannot filter by value, so rows are dropped
+    before any tuple is built. A current cache answers directly; otherwise
+    only these columns (and Deadline, for the order) are fetched, and the
+    cache is left as it is. If Sheets fails, the last index read is used.
+    """
+    fields = tuple(fields)
+    index = _current_index(retries)
+    if index is not None:
+        return _project(index, fields, window)
+    wanted = fields if "Deadline" in fields else fields + ("Deadline",)
+    position = wanted.index("Deadline")
+
+    def read():
+        dated = []
+        for row in _read_columns(wanted):
+            if any(row[:len(fields)]):
+                ordinal = parse_ordinal(row[position])
+                dated.append((float("inf") if ordinal is None else ordinal, row[:len(fields)]))
+        if window is not None:
+            first, last = _window_ordinals(window)
+            dated = [(ordinal, row) for ordinal, row in dated if first <= ordinal <= last]
+        # Stable, so rows due the same day keep their sheet order
+        dated.sort(key=lambda item: item[0])
+        return [row for _, row in dated]
+
+    rows = _call("get_columns", read, retries)
+    if isinstance(rows, SheetsError):
+        with _cache_lock:
+            stale = _index
+        if stale is not None:
+            print(f"Serving columns from the last index: get_columns failed ({rows.message})")
+            return _project(stale, fields, window)
+    return rows
+
+def _fetch_records(retries=3):
+    def read():
+        # Only the columns the bot uses are downloaded; the index keeps the
+        # records sorted with dates parsed once
+        rows = [row for row in _read_columns(SHEET_COLUMNS) if any(row)]
+        return DeadlineIndex([dict(zip(SHEET_COLUMNS, row)) for row in rows], key=record_key)
+    return _call("get_all_records", read, retries)
+
+def _store(index):
+    global _last_good, _index
+    if isinstance(index, SheetsError):
+        return
+    records = index.records()
+    with _cache_lock:
+        _cache["records"] = records
+        _cache["fetched_at"] = time.monotonic()
+        _last_good = records
+        _index = index
+
+def prime_cache(records=None):
+    """Serve reads from the cache until the process exits, seeding it with records if given"""
+    global _mirrored
+    if records is not None:
+        _store(DeadlineIndex(records, key=record_key))
+    _mirrored = True
+
+def _background_refresh(retries):
+    global _refreshing
+    try:
+        _store(_fetch_records(retries))
+        with _cache_lock:
+            cache_stats["refreshes"] += 1
+    finally:
+        with _cache_lock:
+            _refreshing = False
+
+def _lookup_cache(retries, fresh):
+    """Return cached records or None on a miss, scheduling a refresh when stale"""
+    global _refreshing
+    with _cache_lock:
+        records = _cache["records"]
+        age = time.monotonic() - _cache["fetched_at"]
+        if fresh:
+            records = None
+        if records is not None and (age < CACHE_TTL or _mirrored):
+            cache_stats["hits"] += 1
+            return list(records)
+        if records is not None and age < CACHE_TTL + CACHE_STALE:
+            cache_stats["stale_hits"] += 1
+            if not _refreshing:
+                _refreshing = True
+                _executor.submit(_background_refresh, retries)
+            return list(records)
+        cache_stats["misses"] += 1
+    return None
+
+def _fallback(error):
+    """Serve the last good snapshot when Sheets fails, if there is one"""
+    with _cache_lock:
+        snapshot = _last_good
+    if snapshot is not None:
+        print(f"Serving last good snapshot: {error.operation} failed ({error.message})")
+        return list(snapshot)
+    return error
+
+def peek_records():
+    """Last good snapshot without touching Sheets, None if nothing was read yet"""
+    with _cache_lock:
+        return list(_last_good) if _last_good is not None else None
+
+def _load(retries):
+    index = _fetch_records(retries)
+    if isinstance(index, SheetsError):
+        return _fallback(index)
+    _store(index)
+    return index.records()
+
+def get_all_records(retries=3, fresh=False):
+    records = _lookup_cache(retries, fresh)
+    if records is not None:
+        return records
+    return _load(retries)
+
+KEY_FIELDS = ("Deadline", "Name", "Link")
+
+def record_key(record):
+    """Identify a deadline by its content rather than by its row position"""
+    return tuple(str(record.get(field, "")) for field in KEY_FIELDS)
+
+def _row_ranges(row_numbers):
+    """Group 1-based row numbers into (start, end) runs, bottom of the sheet first"""
+    ranges = []
+    for row in sorted(row_numbers, reverse=True):
+        if ranges and ranges[-1][0] == row + 1:
+            ranges[-1][0] = row
+        else:
+            ranges.append([row, row])
+    return ranges
+
+def delete_records(keys, retries=3):
+    """Delete every row whose record_key is in keys with one batch update"""
+    keys = set(keys)
+    if not keys:
+        return True
+
+    def delete():
+        rows = [number for number, row in enumerate(_read_columns(KEY_FIELDS), start=2) if row in keys]
+        if rows:
+            # Requests in a batch run in order and atomically; going bottom-up
+            # keeps the remaining indices valid.
+            sh.batch_update({"requests": [
+                {"deleteDimension": {"range": {
+                    "sheetId": worksheet.id,
+                    "dimension": "ROWS",
+                    "startIndex": start - 1,
+                    "endIndex": end,
+                }}}
+                for start, end in _row_ranges(rows)
+            ]})
+            print(f"Deleted {len(rows)} rows from 'Deadline_checker'")
+            _patch_index(lambda index: index.remove(keys))
+        return True
+    return _call("delete_records", delete, retries)
+
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(_executor, partial(func, *args)), SHEETS_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Sheets call {func.__name__} timed out after {SHEETS_TIMEOUT}s")
+        SHEETS_ERRORS.inc(func.__name__, "timeout")
+        return SheetsError(func.__name__, f"timed out after {SHEETS_TIMEOUT}s")
+    finally:
+        record("sheets", time.perf_counter() - started)
+
+async def connect_async(retries=3):
+    return await _run(connect, retries)
+
+async def get_all_records_async(retries=3, fresh=False):
+    """Non-blocking get_all_records; cache hits never leave the event loop"""
+    records = _lookup_cache(retries, fresh)
+    if records is not None:
+        return records
+    records = await _run(_load, retries)
+    if isinstance(records, SheetsError):
+        return _fallback(records)
+    return records
+
+async def fetch_records_async(retries=3):
+    """Read the sheet itself, past the cache; a SheetsError on failure, never the last good snapshot"""
+    index = await _run(_fetch_records, retries)
+    if isinstance(index, SheetsError):
+        return index
+    _store(index)
+    return index.records()
+
+async def add_rows_async(rows, retries=3):
+    return await _run(add_rows, rows, retries)
+
+async def get_columns_async(fields, window=None, retries=3):
+    """Non-blocking get_columns; answers from a current cache never leave the event loop"""
+    index = _current_index(retries)
+    if index is not None:
+        return _project(index, tuple(fields), window)
+    return await _run(get_columns, fields, window, retries)
+
+async def delete_records_async(keys, retries=3):
+    return await _run(delete_records, list(keys), retries)
@@ -0,0 +1,388 @@
+import asyncio
+import functools
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import getenv
+
+from metrics import DB_BATCH_SIZE, DB_COMMIT_SECONDS, DB_SECONDS
+from profiling import record
+
+# A write waits at most COMMIT_WINDOW seconds for others to share its commit
+COMMIT_WINDOW = float(getenv("DB_COMMIT_WINDOW", "0.005"))
+MAX_BATCH = int(getenv("DB_MAX_BATCH", "256"))
+READ_THREADS = int(getenv("DB_READ_THREADS", "2"))
+
+db = None
+
+
+def _column_names(connection, table):
+    return [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+
+
+def _v1_initial(connection):
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER UNIQUE,
+        username TEXT,
+        role TEXT
+    )
+''')
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS queues (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+''')
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS queue_members (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        queue_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        priority INTEGER DEFAULT 0,
+        joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (queue_id) REFERENCES queues (id) ON DELETE CASCADE,
+        UNIQUE(queue_id, chat_id)
+    )
+''')
+
+
+def _v2_users_active(connection):
+    # Databases created while the column was added inline may already have it
+    if 'active' not in _column_names(connection, 'users'):
+        connection.execute("ALTER TABLE users ADD COLUMN active INTEGER DEFAULT 1")
+
+
+def _v3_indexes(connection):
+    # Covers get_queue_members: filter by queue, read rows already in display order
+    connection.execute('''
+    CREATE INDEX IF NOT EXISTS idx_queue_members_order
+    ON queue_members (queue_id, priority DESC, joined_at, chat_id, username)
+''')
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_queue_members_username ON queue_members (queue_id, username)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_users_active ON users (active, chat_id)")
+
+
+def _v4_queue_positions(connection):
+    # Explicit order instead of joined_at timestamps, which tie within a second
+    if 'position' not in _column_names(connection, 'queue_members'):
+        connection.execute("ALTER TABLE queue_members ADD COLUMN position INTEGER NOT NULL DEFAULT 0")
+    connection.execute('''
+    UPDATE queue_members SET position = (
+        SELECT rn FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY queue_id ORDER BY joined_at, id) - 1 AS rn
+            FROM queue_members
+        ) ranked WHERE ranked.id = queue_members.id
+    )
+''')
+    connection.execute("DROP INDEX IF EXISTS idx_queue_members_order")
+    connection.execute('''
+    CREATE INDEX IF NOT EXISTS idx_queue_members_order
+    ON queue_members (queue_id, priority DESC, position, chat_id, username)
+''')
+
+
+def _v5_fsm_states(connection):
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID
+''')
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_expires ON fsm_states (expires_at)")
+
+
+def _v6_leases(connection):
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+''')
+
+
+def _v7_reminder_prefs(connection):
+    # JSON settings (see preferences.ReminderPrefs); NULL = default schedule
+    if 'reminder_prefs' not in _column_names(connection, 'users'):
+        connection.execute("ALTER TABLE users ADD COLUMN reminder_prefs TEXT")
+
+
+def _v8_sheet_rows(connection):
+    # Local mirror of the Deadline_checker sheet (see mirror.py), one row per
+    # sheet row keyed by its content hash
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS sheet_rows (
+        hash TEXT PRIMARY KEY,
+        position INTEGER NOT NULL,
+        record TEXT NOT NULL
+    ) WITHOUT ROWID
+''')
+
+
+def _v9_prefs_version(connection):
+    # Bumped from a shared counter whenever reminder settings or the
+    # subscription change, so the lease holder can poll for changes made on
+    # any instance
+    if 'prefs_version' not in _column_names(connection, 'users'):
+        connection.execute("ALTER TABLE users ADD COLUMN prefs_version INTEGER NOT NULL DEFAULT 0")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_users_prefs_version ON users (prefs_version)")
+
+
+def _v10_sheet_rows_pending(connection):
+    # Rows the bot remembered before appending them; NULL once seen in the sheet
+    if 'pending_since' not in _column_names(connection, 'sheet_rows'):
+        connection.execute("ALTER TABLE sheet_rows ADD COLUMN pending_since REAL")
+
+
+def _v11_queue_versions(connection):
+    # Named change counters shared by every instance (see next_version), and
+    # each queue's version, bumped from the "queues" counter on every queue write
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID
+''')
+    if 'version' not in _column_names(connection, 'queues'):
+        connection.execute("ALTER TABLE queues ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+def _v12_fsm_versions(connection):
+    # Bumped from the "fsm" counter on every state write, so each instance can
+    # poll for states changed elsewhere instead of re-reading them per update
+    if 'version' not in _column_names(connection, 'fsm_states'):
+        connection.execute("ALTER TABLE fsm_states ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_version ON fsm_states (version)")
+
+
+# (version, migration) pairs, applied in order. PRAGMA user_version records the
+# last one applied; append new entries, never edit released ones.
+MIGRATIONS = [
+    (1, _v1_initial),
+    (2, _v2_users_active),
+    (3, _v3_indexes),
+    (4, _v4_queue_positions),
+    (5, _v5_fsm_states),
+    (6, _v6_leases),
+    (7, _v7_reminder_prefs),
+    (8, _v8_sheet_rows),
+    (9, _v9_prefs_version),
+    (10, _v10_sheet_rows_pending),
+    (11, _v11_queue_versions),
+    (12, _v12_fsm_versions),
+]
+
+
+def next_version(con, name):
+    """Bump the named counter and return its new value; writes are serialized, so values never repeat"""
+    con.execute("""
+        INSERT INTO counters (name, value) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1
+    """, (name,))
+    return con.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+
+
+def migrate(connection):
+    """Apply pending migrations, each in its own transaction.
+
+    connection must be in autocommit mode (isolation_level=None): the sqlite3
+    module does not open transactions for DDL itself, so BEGIN is explicit and
+    a failed migration rolls back together with its user_version bump.
+    """
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for target, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            migration(connection)
+            connection.execute(f"PRAGMA user_version = {target}")
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        print(f"Database migrated to version {target}")
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def connect(database_path, **kwargs):
+    """Open a tuned connection: WAL journal, NORMAL sync, enforced foreign keys"""
+    db_dir = os.path.dirname(database_path)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir, exist_ok=True)
+    connection = sqlite3.connect(database_path, cached_statements=256, **kwargs)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.execute("PRAGMA busy_timeout=5000")
+    return connection
+
+
+class Database:
+    """SQLite access off the event loop.
+
+    Writes are queued to one writer thread that runs every job waiting within
+    COMMIT_WINDOW in a single transaction (one fsync for the whole batch), each
+    job inside its own savepoint so a failing job does not undo the others.
+    Reads run on a small pool with their own connections and see every write
+    whose awaitable has completed.
+    """
+
+    def __init__(self, database_path, commit_window=COMMIT_WINDOW, max_batch=MAX_BATCH, read_threads=READ_THREADS):
+        self.path = database_path
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self.writer = connect(database_path, check_same_thread=False, isolation_level=None)
+        migrate_conn = connect(database_path, isolation_level=None)
+        migrate(migrate_conn)
+        migrate_conn.close()
+        self._jobs = queue.Queue()
+        self._local = threading.local()
+        self._readers = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix="db-read")
+        self._thread = threading.Thread(target=self._write_loop, name="db-write", daemon=True)
+        self._thread.start()
+        self.stats = {"commits": 0, "writes": 0}
+
+    def _reader_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = connect(self.path)
+        return connection
+
+    def _read_job(self, func, args):
+        started = time.perf_counter()
+        try:
+            return func(self._reader_connection(), *args)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, "read", func.__name__)
+
+    def _collect(self):
+        first = self._jobs.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.commit_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._jobs.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                self._jobs.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _run_batch(self, batch):
+        """Run a batch in one transaction; [(future, result, error)] per job"""
+        results = []
+        self.writer.execute("BEGIN")
+        for func, args, future in batch:
+            started = time.perf_counter()
+            self.writer.execute("SAVEPOINT job")
+            try:
+                results.append((future, func(self.writer, *args), None))
+                self.writer.execute("RELEASE job")
+            except Exception as e:
+                # If even the rollback fails, the whole batch fails in _write_loop
+                self.writer.execute("ROLLBACK TO job")
+                self.writer.execute("RELEASE job")
+                results.append((future, None, e))
+            DB_SECONDS.observe(time.perf_counter() - started, "write", func.__name__)
+        started = time.perf_counter()
+        self.writer.execute("COMMIT")
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+        return results
+
+    def _write_loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                results = self._run_batch(batch)
+            except Exception as e:
+                # Nothing of the batch was committed; fail every job and keep the writer alive
+                print(f"Database write batch of {len(batch)} failed: {e}")
+                if self.writer.in_transaction:
+                    try:
+                        self.writer.execute("ROLLBACK")
+                    except sqlite3.Error as rollback_error:
+                        print(f"Database rollback failed: {rollback_error}")
+                results = [(future, None, e) for _, _, future in batch]
+            DB_BATCH_SIZE.observe(len(batch))
+            self.stats["commits"] += 1
+            self.stats["writes"] += len(batch)
+            for future, result, error in results:
+                # A caller that gave up cancelled its future
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    def submit(self, func, *args):
+        """Queue func(connection, *args) for the next group commit without waiting"""
+        future = Future()
+        self._jobs.put((func, args, future))
+        return future
+
+    async def write(self, func, *args):
+        """Run func(connection, *args) in the next group commit"""
+        started = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(self.submit(func, *args))
+        finally:
+            record("db", time.perf_counter() - started)
+
+    async def read(self, func, *args):
+        """Run func(connection, *args) on a read connection"""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._readers, self._read_job, func, args)
+        finally:
+            record("db", time.perf_counter() - started)
+
+    def close(self):
+        """Flush pending writes and stop the writer thread"""
+        self._jobs.put(None)
+        self._thread.join()
+        self._readers.shutdown(wait=True)
+        self.writer.close()
+
+
+def writes(func):
+    """Turn func(connection, ...) into an awaitable run by the writer thread"""
+    @functools.wraps(func)
+    async def wrapper(*args):
+        return await db.write(func, *args)
+    return wrapper
+
+
+def reads(func):
+    """Turn func(connection, ...) into an awaitable run on a read connection"""
+    @functools.wraps(func)
+    async def wrapper(*args):
+        return await db.read(func, *args)
+    return wrapper
+
+
+def init_db(database_path):
+    """Open the bot database, bring its schema up to date and keep it as storage.db"""
+    global db
+    db = Database(database_path)
+    return db
@@ -11,18 +11,128 @@ def get_keyboard(buttons):
     menu_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard)
     return menu_keyboard
 
-def all_deadlines(records, fields=['Deadline', 'Name', 'Link']):
-    res = ''
+def iter_deadlines(records, fields=('Deadline', 'Name', 'Link')):
+    """Yield numbered lines lazily, skipping records with an empty field.
+
+    Records are dicts, or tuples already projected to fields (see sheets.get_columns).
+    """
     count = 1
     for record in records:
-        values = []
-        f = 1
-        for field in fields:
-            if record.get(field, '') == '':
-                f = 0
-                continue
-            values.append(str(record.get(field, '')))
-        if f == 1:
-            res += f"{count}. {' '.join(values)}\n"
-            count += 1
-    return res
\ No newline at end of file
+        if isinstance(record, tuple):
+            values = [str(value) for value in record]
+        else:
+            values = [str(record.get(field, '')) for field in fields]
+        if '' in values:
+            continue
+        yield f"{count}. {' '.join(values)}\n"
+        count += 1
+
+def all_deadlines(records, fields=['Deadline', 'Name', 'Link']):
+    return ''.join(iter_deadlines(records, fields))
+
+MESSAGE_LIMIT = 4096
+
+DIGEST_SECTIONS = [
+    ('week', "<b>Weekly Reminder</b> — 1 week left", "Time to start planning!"),
+    ('tomorrow', "<b>Final Reminder</b> — deadline tomorrow", "Last chance to finish!"),
+    ('today', "<b>DEADLINE TODAY!</b>", "Submit now!"),
+    ('expired', "<b>Deadline Expired</b> — yesterday", "These tasks will be deleted now."),
+]
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Split text into chunks under Telegram's message limit, on line boundaries"""
+    chunks = []
+    current = ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ''
+        current += line
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+def _offset_section(offset):
+    if offset > 0:
+        return (offset, f"<b>Reminder</b> — {offset} days left", "Time to start planning!")
+    return (offset, f"<b>Deadline Expired</b> — {-offset} days ago", "These tasks will be deleted now.")
+
+def build_digest(sections):
+    """Render one reminder message from {section: [(date, name), ...]}.
+
+    Sections are the DIGEST_SECTIONS names, or a day offset for reminder
+    offsets without a named section.
+    """
+    named = {key for key, _, _ in DIGEST_SECTIONS}
+    extra = sorted((key for key in sections if key not in named), reverse=True)
+    parts = []
+    for key, title, hint in DIGEST_SECTIONS + [_offset_section(offset) for offset in extra]:
+        items = sections.get(key)
+        if not items:
+            continue
+        lines = [title, '']
+        lines.extend(f"• <b>{deadline_date}</b> {name}" for deadline_date, name in items)
+        lines.extend(['', f"<i>{hint}</i>"])
+        parts.append('\n'.join(lines))
+    return '\n\n'.join(parts)
+
+def build_change_notice(added, edited):
+    """Announce deadlines added or changed in the sheet; edited is [(old, new), ...]"""
+    parts = []
+    if added:
+        lines = ["<b>New Deadlines</b>", '']
+        lines.extend(f"• <b>{record.get('Deadline', '')}</b> {record.get('Name', '')}" for record in added)
+        parts.append('\n'.join(lines))
+    if edited:
+        lines = ["<b>Deadlines Changed</b>", '']
+        for old, new in edited:
+            line = f"• <b>{new.get('Deadline', '')}</b> {new.get('Name', '')}"
+            if str(old.get('Deadline', '')) != str(new.get('Deadline', '')):
+                line += f" (was {old.get('Deadline', '')})"
+            lines.append(line)
+        parts.append('\n'.join(lines))
+    return '\n\n'.join(parts)
+
+# Room left for the header and footer around a page of deadlines
+PAGE_LIMIT = 3500
+
+def paginate(lines, limit=PAGE_LIMIT):
+    """Group lines into pages of at most limit characters"""
+    page = []
+    size = 0
+    for line in lines:
+        if page and size + len(line) > limit:
+            yield ''.join(page)
+            page = []
+            size = 0
+        page.append(line)
+        size += len(line)
+    if page:
+        yield ''.join(page)
+
+def get_page(records, fields, page, limit=PAGE_LIMIT):
+    """Return (text, page, has_next) for a 0-based page, clamped to the last one"""
+    text = ''
+    current = -1
+    for index, chunk in enumerate(paginate(iter_deadlines(records, fields), limit)):
+        if index > page:
+            return text, current, True
+        text, current = chunk, index
+    return text, max(current, 0), False
+
+def page_keyboard(prefix, page, has_next):
+    """Prev/next buttons with callback data '<prefix>:<page>', None for a single page"""
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="« Prev", callback_data=f"{prefix}:{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="Next »", callback_data=f"{prefix}:{page + 1}"))
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
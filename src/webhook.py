@@ -0,0 +1,103 @@
+import asyncio
+import hmac
+from os import getenv
+
+from aiogram.types import Update
+from aiohttp import web
+
+# BOT_MODE=webhook serves updates over HTTP instead of long polling
+BOT_MODE = getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(getenv("WEBHOOK_WORKERS", "8"))
+# Updates waiting for a worker; past this Telegram gets 503 and redelivers later
+WEBHOOK_QUEUE_SIZE = int(getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Receives Telegram updates over HTTP and feeds them to the dispatcher.
+
+    Each POST is checked against the secret token, parsed and queued, and
+    Telegram gets its 200 straight away; a fixed pool of workers runs the
+    handlers in the background. Recorded Update JSON can be posted to the
+    endpoint by hand for local testing.
+
+    A secret is required: without it anyone could post updates that claim
+    to come from an admin.
+    """
+
+    def __init__(self, dp, bot, secret=WEBHOOK_SECRET, workers=WEBHOOK_WORKERS, path=WEBHOOK_PATH,
+                 queue_size=WEBHOOK_QUEUE_SIZE):
+        if not secret:
+            raise ValueError("WEBHOOK_SECRET must be set when BOT_MODE=webhook")
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.workers = workers
+        self.path = path
+        self.updates = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle)
+        self.app.on_startup.append(self._start_workers)
+        self.app.on_shutdown.append(self._stop_workers)
+
+    def _authorized(self, request):
+        return hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret)
+
+    async def handle(self, request):
+        if not self._authorized(request):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            print(f"Rejected webhook payload: {e}")
+            return web.Response(status=400)
+        try:
+            self.updates.put_nowait(update)
+        except asyncio.QueueFull:
+            print(f"Webhook queue full, update {update.update_id} deferred")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self.updates.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                print(f"Update {update.update_id} failed: {e}")
+            finally:
+                self.updates.task_done()
+
+    async def _start_workers(self, app):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _stop_workers(self, app):
+        # Finish what Telegram has already been told was received
+        await self.updates.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def run(self, host=WEBHOOK_HOST, port=WEBHOOK_PORT, url=WEBHOOK_URL):
+        """Serve until cancelled; registers the webhook with Telegram when url is set"""
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        if url:
+            await self.bot.set_webhook(
+                url.rstrip("/") + self.path,
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types(),
+            )
+        print(f"Webhook server listening on {host}:{port}{self.path}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()